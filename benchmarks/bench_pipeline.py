@@ -0,0 +1,175 @@
+"""Times and memory-profiles every stage of the gen_scen_fnctns pipeline on pandapower's bundled grids.
+
+Usage (from the project root):
+    python benchmarks/bench_pipeline.py --cases case14 case118 --scenarios 10 100 --noise 1 10
+    python benchmarks/bench_pipeline.py --compare benchmarks/results/old.json benchmarks/results/new.json
+
+Results are written as JSON (one record per case/stage/scenario count/noise multiplicity) so that runs of two commits
+can be compared with --compare.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError: #not available on Windows
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+import pandas as pd
+import pandapower as pp
+import pandapower.networks as nw
+
+from src.power.gen_scen_fnctns import *
+
+DEFAULT_CASES = ['case14', 'case118', 'case1354pegase', 'case2869pegase']
+
+
+class StageTimer:
+    def __init__(self, case, trace_memory):
+        self.case = case
+        self.trace_memory = trace_memory
+        self.records = []
+
+    def run(self, stage, func, *args, n_scenarios=None, noise_per_clean=None, **kwargs):
+        #Runs one stage with its prints silenced and records wall time and (traced) peak memory. A failing stage is
+        #recorded with its error and returns None.
+        record = {'case': self.case, 'stage': stage, 'n_scenarios': n_scenarios, 'noise_per_clean': noise_per_clean}
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                result = func(*args, **kwargs)
+            record['error'] = None
+        except Exception as err:
+            result = None
+            record['error'] = repr(err)
+        record['time_s'] = time.perf_counter() - start
+        if self.trace_memory:
+            record['peak_mem_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+        self.records.append(record)
+        print('{:16} {:28} n={!s:6} noise={!s:4} {:10.4f} s {}'.format(
+            self.case, stage, n_scenarios, noise_per_clean, record['time_s'],
+            '' if record['error'] is None else 'FAILED ' + record['error']))
+        return result
+
+
+def bench_case(case, scenario_counts, noise_counts, trace_memory, work_dir):
+    os.makedirs(work_dir, exist_ok=True)
+    timer = StageTimer(case, trace_memory)
+    net = getattr(nw, case)()
+    pp.runpp(net)
+
+    all_meas = timer.run('gen_meas_picker', gen_meas_picker, net, os.path.join(work_dir, 'meas_template.csv'))
+    if all_meas is None:
+        return timer.records
+
+    h4all = timer.run('gen_h4all', gen_h4all, net)
+    base_net_path = os.path.join(work_dir, case + '_') #gen_meas prefixes its file names with this path
+    timer.run('gen_meas', gen_meas, net, all_meas, h4all, base_net_path, 0.02)
+
+    run_hp = {'noise_on_meas': 'gaussian'}
+    for n_scenarios in scenario_counts:
+        ids, clean = timer.run('gen_clean_scen_unfrm', gen_clean_scen_unfrm, net, n_scenarios, 'A', seed=0,
+                               n_scenarios=n_scenarios) or (None, None)
+        timer.run('gen_clean_scen_unfrm_dc', gen_clean_scen_unfrm, net, n_scenarios, 'A', seed=0, mode='dc',
+                  n_scenarios=n_scenarios)
+        if clean is None:
+            continue
+        for noise_per_clean in noise_counts:
+            kwargs = {'n_scenarios': n_scenarios, 'noise_per_clean': noise_per_clean}
+            dplct_ids, dplct = timer.run('duplicate_scenarios', duplicate_scenarios, ids, clean, noise_per_clean, **kwargs)
+            noisy_ids, noisy = timer.run('gen_noisy_meas', gen_noisy_meas, run_hp, dplct_ids, dplct, seed=0, **kwargs)
+            timer.run('gen_noisy_scenarios', gen_noisy_scenarios, run_hp, ids, clean, noise_per_clean, seed=0, **kwargs)
+            clean_meas = timer.run('meas2features', meas2features, dplct_ids, dplct, **kwargs)
+            states = timer.run('pf_states2features', pf_states2features, dplct_ids, dplct, **kwargs)
+            timer.run('pfdc_states2features', pfdc_states2features, dplct_ids, dplct, **kwargs)
+            noisy_meas = timer.run('meas2features_noisy', meas2features, noisy_ids, noisy, **kwargs)
+            if clean_meas is not None and states is not None:
+                batches = NoisyBatches(clean_meas, states, clean.meas_std_dev, seed=0)
+                timer.run('noisy_batches_epoch', lambda: sum(len(x) for x, _ in batches), **kwargs)
+            for name, data in [('source_clean_meas', clean_meas), ('target_gt_states', states),
+                               ('source_noisy_meas', noisy_meas)]:
+                if data is not None:
+                    timer.run('to_csv_' + name, data.to_csv, os.path.join(work_dir, name + '.csv'), index=False, **kwargs)
+    return timer.records
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(old_path, new_path):
+    #Prints the time (and memory) ratio new/old of every record present in both result files
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    key = lambda record: (record['case'], record['stage'], record['n_scenarios'], record['noise_per_clean'])
+    old_records = {key(record): record for record in old['records']}
+    print('{:16} {:28} {:>6} {:>5} {:>10} {:>10} {:>7} {:>7}'.format(
+        'case', 'stage', 'n', 'noise', 'old [s]', 'new [s]', 'time x', 'mem x'))
+    for record in new['records']:
+        before = old_records.get(key(record))
+        if before is None or before['error'] or record['error']:
+            continue
+        mem_ratio = (record['peak_mem_mb'] / before['peak_mem_mb']
+                     if record.get('peak_mem_mb') and before.get('peak_mem_mb') else float('nan'))
+        print('{:16} {:28} {!s:>6} {!s:>5} {:10.4f} {:10.4f} {:7.2f} {:7.2f}'.format(
+            record['case'], record['stage'], record['n_scenarios'], record['noise_per_clean'], before['time_s'],
+            record['time_s'], record['time_s'] / max(before['time_s'], 1e-12), mem_ratio))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', nargs='+', default=DEFAULT_CASES, help='pandapower.networks case names')
+    parser.add_argument('--scenarios', nargs='+', type=int, default=[10, 100], help='numbers of clean scenarios')
+    parser.add_argument('--noise', nargs='+', type=int, default=[1, 10], help='noisy scenarios per clean scenario')
+    parser.add_argument('--no-memory', action='store_true', help='do not trace memory (tracemalloc slows stages down)')
+    parser.add_argument('--output', default=None, help='result JSON (default benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    commit = git_commit()
+    records = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for case in args.cases:
+            records += bench_case(case, args.scenarios, args.noise, not args.no_memory, os.path.join(work_dir, case))
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results',
+                                         '{}.json'.format(commit or datetime.datetime.now().strftime('%Y%m%d%H%M%S')))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'commit': commit,
+                   'date': datetime.datetime.now().isoformat(),
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'versions': {'numpy': np.__version__, 'pandas': pd.__version__, 'pandapower': pp.__version__},
+                   'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else None,
+                   'records': records}, f, indent=1)
+    print('Results written to {}'.format(output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 2 #part of every key, bump when the cached artifacts change
+
+
+def hash_base_inputs(net, all_meas, inst_err):
+    #Content hash of everything the base artifacts depend on: the element tables of the net (results excluded), the
+    #measurement template and inst_err
+    digest = hashlib.sha256()
+    digest.update(repr((CACHE_VERSION, float(inst_err), float(net.sn_mva), float(net.f_hz))).encode())
+    tables = [(key, net[key]) for key in sorted(net.keys())
+              if isinstance(net[key], pd.DataFrame) and not key.startswith(('res_', '_')) and len(net[key])]
+    for key, table in tables + [('meas_template', all_meas)]:
+        digest.update(repr((key, list(table.columns), [str(dtype) for dtype in table.dtypes])).encode())
+        try:
+            row_hashes = pd.util.hash_pandas_object(table, index=True)
+        except TypeError: #unhashable cells (e.g. lists in object columns)
+            row_hashes = pd.util.hash_pandas_object(table.astype(str), index=True)
+        digest.update(row_hashes.values.tobytes())
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+    #Folder of cache entries, one subfolder per key holding pickled objects (artifacts.pkl) and copies of files. The least
+    #recently used entries are evicted once the cache exceeds max_bytes.
+
+    def __init__(self, path, max_bytes=2**30):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key)
+
+    def load(self, key):
+        #Cached objects of key (None if not cached); files of the entry are in entry_path(key)
+        entry = self.entry_path(key)
+        try:
+            with open(os.path.join(entry, 'artifacts.pkl'), 'rb') as f:
+                objects = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(entry) #mark as recently used
+        return objects
+
+    def store(self, key, objects, files=None):
+        #Writes the entry under a temporary name first, so a crash never leaves a partial entry. files maps the names of
+        #the entry files to the paths they are copied from (output_path + name may carry a prefix, e.g. 'case14_')
+        entry = self.entry_path(key)
+        tmp = '{}.tmp-{}'.format(entry, os.getpid())
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name, file_path in (files or {}).items():
+            shutil.copyfile(file_path, os.path.join(tmp, name))
+        with open(os.path.join(tmp, 'artifacts.pkl'), 'wb') as f:
+            pickle.dump(objects, f, protocol=pickle.HIGHEST_PROTOCOL)
+        if os.path.exists(os.path.join(entry, 'artifacts.pkl')):
+            #stored by a concurrent job in the meantime (same key, same artifacts), which other jobs may be reading
+            shutil.rmtree(tmp, ignore_errors=True)
+        else:
+            shutil.rmtree(entry, ignore_errors=True) #not a complete entry
+            try:
+                os.replace(tmp, entry)
+            except OSError: #published by a concurrent job since the check
+                shutil.rmtree(tmp, ignore_errors=True)
+        self.evict(keep=key)
+
+    def entries(self):
+        #(last use, size in bytes, key) of all complete entries
+        entries = []
+        for key in os.listdir(self.path):
+            entry = self.entry_path(key)
+            if '.tmp-' in key or not os.path.isdir(entry):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+            entries.append((os.path.getmtime(entry), size, key))
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries: #oldest first
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.entry_path(key), ignore_errors=True)
+            total -= size
+            logger.info('Base cache: evicted %s (%.1f MB)', key[:12], size / 2**20)
+
+    def clear(self):
+        for _, _, key in self.entries():
+            shutil.rmtree(self.entry_path(key), ignore_errors=True)
@@ -0,0 +1,207 @@
+"""Command line entry point of the scenario generator (headless version of the notebooks).
+
+Usage (from the project root):
+    python -m src.power.cli config > run.json             # default config, edit as needed
+    python -m src.power.cli template --grid case118        # measurement template (runs/meas_template.csv)
+    python -m src.power.cli base --config run.json         # base net, grid tables and H of a new run folder
+    python -m src.power.cli generate --config run.json     # base net and H, then the datasets
+    python -m src.power.cli generate --config run.json --trial T --shard 0/8 --seed 1 --noise-seed 2
+    python -m src.power.cli merge runs/T/datasets runs/T/datasets/shard-*
+
+The config file holds the input_params of the notebook (set_id, n_clean_scenarios, noise_per_clean, inst_error,
+noise_on_meas, load_sampling) and the run options below (see DEFAULT_CONFIG). pandapower and the generator are only
+imported once the command line is parsed, and plotting only with --plot.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    'grid': 'case118', #pandapower.networks case name or a pandapower .json/.p file
+    'meas_template': 'runs/meas_template.csv',
+    'runs_path': 'runs/',
+    'trial': None, #run folder name, Power_<set_id>_<date and time> if None
+    'set_id': 'A',
+    'n_clean_scenarios': 500,
+    'noise_per_clean': 10,
+    'inst_error': 0.02,
+    'noise_on_meas': 'gaussian',
+    'load_sampling': 'uniform', #LoadSampler kind or parameters
+    'mode': 'ac',
+    'n_workers': 1,
+    'seed': None,
+    'noise_seed': None,
+    'warm_start': 'base',
+    'retry': None, #RetryPolicy parameters, None for the default chain, false for no retries
+    'noisy': True,
+    'formats': ['csv'],
+    'chunk_size': 1000,
+    'h_formats': ['npz'],
+    'cache': True, #cache the base net and H in runs_path/cache/
+}
+
+
+def load_config(path=None, **overrides):
+    #DEFAULT_CONFIG updated with the config file and with the overrides that are not None
+    config = dict(DEFAULT_CONFIG)
+    if path is not None:
+        with open(path) as f:
+            loaded = json.load(f)
+        unknown = set(loaded) - set(DEFAULT_CONFIG)
+        if unknown:
+            raise ValueError('Unknown config keys in {}: {}'.format(path, ', '.join(sorted(unknown))))
+        config.update(loaded)
+    config.update({key: value for key, value in overrides.items() if value is not None})
+    return config
+
+
+def load_grid(grid):
+    import pandapower as pp
+    if grid.endswith('.json'):
+        return pp.from_json(grid)
+    if grid.endswith(('.p', '.pkl')):
+        return pp.from_pickle(grid)
+    import pandapower.networks as nw
+    if not hasattr(nw, grid):
+        raise ValueError('{!r} is neither a pandapower.networks case nor a .json/.p file'.format(grid))
+    return getattr(nw, grid)()
+
+
+def run_paths(config):
+    #Run folder and its subfolders as created by the notebook
+    trial = config['trial'] or 'Power_{}_{:%Y%m%d%H%M}'.format(config['set_id'], datetime.datetime.now())
+    trial_path = os.path.join(config['runs_path'], trial) + '/'
+    paths = {'trial': trial_path}
+    for name in ['grid', 'datasets', 'base_net']:
+        paths[name] = trial_path + name + '/'
+        os.makedirs(paths[name], exist_ok=True)
+    return paths
+
+
+def plot_grid(net, path):
+    import matplotlib
+    matplotlib.use('Agg') #no display needed
+    import pandapower.plotting as plot
+    from .fileio import replacing
+    net_ax = plot.simple_plot(net, show_plot=False)
+    with replacing(path) as tmp:
+        net_ax.get_figure().savefig(tmp, format='png')
+
+
+def prepare_run(config, plot=False):
+    #Base net, grid tables and H of the run folder (the first cells of generate_load_scenarios.ipynb). Every file is
+    #written under a temporary name and renamed, so shards of a run can prepare the same run folder in parallel.
+    if plot:
+        import matplotlib #fails before the base net is solved if plotting is not installed
+    import pandas as pd
+    from .fileio import replacing
+    from .gen_scen_fnctns import prepare_base_net
+
+    paths = run_paths(config)
+    net = load_grid(config['grid'])
+    all_meas = pd.read_csv(config['meas_template'])
+    cache_path = os.path.join(config['runs_path'], 'cache/') if config['cache'] else None
+    net, *_ = prepare_base_net(net, all_meas, paths['base_net'], config['inst_error'], cache_path=cache_path,
+                               h_formats=tuple(config['h_formats']))
+    for element in ['bus', 'line', 'trafo', 'trafo3w', 'gen', 'load']:
+        with replacing(paths['grid'] + 'grid_{}.csv'.format(element)) as tmp:
+            net[element].to_csv(tmp)
+    if plot:
+        plot_grid(net, paths['grid'] + 'grid_plot.png')
+    with replacing(paths['trial'] + 'config.json') as tmp, open(tmp, 'w') as f:
+        json.dump(config, f, indent=1)
+    logger.info('Run folder: %s', paths['trial'])
+    return net, paths
+
+
+def parse_shard(text):
+    k, n_shards = text.split('/')
+    return int(k), int(n_shards)
+
+
+def cmd_config(args):
+    json.dump(DEFAULT_CONFIG, sys.stdout, indent=1)
+    sys.stdout.write('\n')
+
+
+def cmd_template(args):
+    from .gen_scen_fnctns import gen_meas_picker
+    gen_meas_picker(load_grid(args.grid), args.output)
+    logger.info('Measurement template written to %s', args.output)
+
+
+def cmd_base(args):
+    prepare_run(load_config(args.config, trial=args.trial), args.plot)
+
+
+def cmd_generate(args):
+    from .gen_scen_fnctns import metrics, write_datasets
+
+    config = load_config(args.config, trial=args.trial, seed=args.seed, noise_seed=args.noise_seed,
+                         n_workers=args.n_workers)
+    if args.shard is not None and config['trial'] is None:
+        raise ValueError('Shards of a run need the same run folder, give --trial (or trial in the config)')
+    metrics.reset()
+    net, paths = prepare_run(config, args.plot)
+    datasets_path = paths['datasets']
+    if args.shard is not None:
+        datasets_path += 'shard-{}-of-{}/'.format(*args.shard)
+    n_written, failed = write_datasets(net, config, datasets_path, formats=tuple(config['formats']),
+                                       chunk_size=config['chunk_size'], mode=config['mode'], n_workers=config['n_workers'],
+                                       seed=config['seed'], noise_seed=config['noise_seed'], warm_start=config['warm_start'],
+                                       noisy=config['noisy'], shard=args.shard, sampler=config['load_sampling'],
+                                       retry=config['retry'])
+    logger.info('%d clean scenarios written to %s (%d failed)', n_written, datasets_path, len(failed))
+
+
+def cmd_merge(args):
+    from .gen_scen_fnctns import merge_shards
+    n_written, failed = merge_shards(args.shards, args.output, tuple(args.formats) if args.formats else None)
+    logger.info('%d clean scenarios merged into %s (%d failed)', n_written, args.output, len(failed))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src.power.cli', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--log-level', default='INFO', help='DEBUG prints one line per scenario, WARNING only failures')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('config', help='print the default config').set_defaults(func=cmd_config)
+
+    template = commands.add_parser('template', help='generate the measurement template of a grid')
+    template.add_argument('--grid', default=DEFAULT_CONFIG['grid'], help='pandapower.networks case or .json/.p file')
+    template.add_argument('--output', default=DEFAULT_CONFIG['meas_template'])
+    template.set_defaults(func=cmd_template)
+
+    for name, func, help_text in [('base', cmd_base, 'solve the base net and export the measurements and H'),
+                                  ('generate', cmd_generate, 'base net and H, then the clean and noisy datasets')]:
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('--config', help='JSON config (see the config command), defaults if omitted')
+        command.add_argument('--trial', help='run folder name under runs_path (overrides the config)')
+        command.add_argument('--plot', action='store_true', help='save grid/grid_plot.png (imports matplotlib)')
+        command.set_defaults(func=func)
+        if name == 'generate':
+            command.add_argument('--seed', type=int)
+            command.add_argument('--noise-seed', type=int)
+            command.add_argument('--n-workers', type=int)
+            command.add_argument('--shard', type=parse_shard, help='k/N: write the k-th (from 0) of N shards')
+
+    merge = commands.add_parser('merge', help='merge the datasets of the shards of a run')
+    merge.add_argument('output', help='datasets folder of the merged run')
+    merge.add_argument('shards', nargs='+', help='datasets folders of the shards')
+    merge.add_argument('--formats', nargs='+', help='formats of the merged datasets (default: those of the shards)')
+    merge.set_defaults(func=cmd_merge)
+
+    args = parser.parse_args(argv)
+    from .instrumentation import configure_logging
+    configure_logging(getattr(logging, args.log_level.upper()))
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
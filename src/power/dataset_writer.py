@@ -0,0 +1,124 @@
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+#File extension per format. npz cannot be appended to, so an npz dataset is a folder of one file per chunk.
+EXTENSIONS = {'parquet': '.parquet', 'hdf5': '.h5', 'npz': '', 'csv': '.csv'}
+ID_COLUMN = 'l_scenario_id'
+
+
+class DatasetWriter:
+    #Appends chunks of a dataset (DataFrames with the l_scenario_id column followed by float feature columns, as returned
+    #by meas2features and pf_states2features) to one file, so only one chunk is ever held in memory.
+    #Formats: 'parquet' (one row group per chunk, needs pyarrow), 'hdf5' (resizable datasets, needs h5py),
+    #'npz' (one compressed file per chunk) and 'csv'.
+
+    def __init__(self, path, fmt='parquet'):
+        if fmt not in EXTENSIONS:
+            raise ValueError('Unknown dataset format {!r}, choose one of {}'.format(fmt, list(EXTENSIONS)))
+        self.path = path + EXTENSIONS[fmt] #path without extension, e.g. datasets_path + 'source_clean_meas'
+        self.fmt = fmt
+        self.columns = None
+        self.n_rows = 0
+        self.n_chunks = 0
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, data):
+        if self.columns is None:
+            self.columns = list(data.columns)
+            self._open()
+        elif list(data.columns) != self.columns:
+            raise ValueError('Chunk columns differ from the first chunk written to {}'.format(self.path))
+        ids = data[ID_COLUMN].astype(str).values
+        values = data.drop(columns=[ID_COLUMN]).values.astype(float)
+
+        if self.fmt == 'parquet':
+            import pyarrow as pa
+            table = pa.Table.from_pandas(data.astype({ID_COLUMN: str}), schema=self._file.schema, preserve_index=False)
+            self._file.write_table(table)
+        elif self.fmt == 'hdf5':
+            for name, chunk in [(ID_COLUMN, ids.astype(object)), ('values', values)]:
+                dataset = self._file[name]
+                dataset.resize(self.n_rows + len(chunk), axis=0)
+                dataset[self.n_rows:] = chunk
+        elif self.fmt == 'npz':
+            np.savez_compressed(os.path.join(self.path, 'part-{:05d}.npz'.format(self.n_chunks)),
+                                ids=ids.astype('U'), values=values, columns=np.array(self.columns[1:], dtype='U'))
+        else:
+            data.to_csv(self.path, mode='a', header=self.n_rows == 0, index=False)
+        self.n_rows += len(data)
+        self.n_chunks += 1
+
+    def _open(self):
+        if self.fmt == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            schema = pa.schema([(ID_COLUMN, pa.string())] + [(str(column), pa.float64()) for column in self.columns[1:]])
+            self._file = pq.ParquetWriter(self.path, schema, compression='zstd')
+        elif self.fmt == 'hdf5':
+            import h5py
+            self._file = h5py.File(self.path, 'w')
+            self._file.create_dataset(ID_COLUMN, shape=(0,), maxshape=(None,), dtype=h5py.string_dtype(), chunks=True)
+            self._file.create_dataset('values', shape=(0, len(self.columns) - 1), maxshape=(None, len(self.columns) - 1),
+                                      dtype='f8', chunks=True, compression='gzip')
+            self._file.attrs['columns'] = [str(column) for column in self.columns[1:]]
+        elif self.fmt == 'npz':
+            os.makedirs(self.path, exist_ok=True)
+            for old_part in glob.glob(os.path.join(self.path, 'part-*.npz')):
+                os.remove(old_part)
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_dataset(path, fmt=None):
+    #Reads a dataset written by DatasetWriter back into a DataFrame. path may be given with or without extension.
+    if fmt is None:
+        fmt = _guess_format(path)
+    if EXTENSIONS[fmt] and not path.endswith(EXTENSIONS[fmt]):
+        path = path + EXTENSIONS[fmt]
+
+    if fmt == 'parquet':
+        return pd.read_parquet(path)
+    elif fmt == 'hdf5':
+        import h5py
+        with h5py.File(path, 'r') as file:
+            ids = file[ID_COLUMN].asstr()[:]
+            values = file['values'][:]
+            columns = list(file.attrs['columns'])
+        return _to_frame(ids, values, columns)
+    elif fmt == 'npz':
+        parts = [np.load(part) for part in sorted(glob.glob(os.path.join(path, 'part-*.npz')))]
+        if not parts:
+            raise FileNotFoundError('No npz parts found in {}'.format(path))
+        return _to_frame(np.concatenate([part['ids'] for part in parts]),
+                         np.concatenate([part['values'] for part in parts]), list(parts[0]['columns']))
+    return pd.read_csv(path, float_precision='round_trip')
+
+
+def _guess_format(path):
+    for fmt, ext in EXTENSIONS.items():
+        if ext and path.endswith(ext):
+            return fmt
+    for fmt, ext in EXTENSIONS.items():
+        if ext and os.path.exists(path + ext):
+            return fmt
+    return 'npz'
+
+
+def _to_frame(ids, values, columns):
+    data = pd.DataFrame(values, columns=columns)
+    data.insert(0, ID_COLUMN, ids.astype(object))
+    return data
@@ -0,0 +1,17 @@
+import contextlib
+import os
+
+
+@contextlib.contextmanager
+def replacing(path):
+    #Yields a temporary path to write to, renamed onto path once written: a crash never leaves a partial file, and the
+    #name is per process so parallel jobs writing the same file (e.g. the shards of a run sharing base_net/) do not
+    #rename each other's temporary file
+    tmp = '{}.tmp-{}'.format(path, os.getpid())
+    try:
+        yield tmp
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, path)
@@ -1,8 +1,33 @@
 import numpy as np
 import pandas as pd
 import pandapower as pp
+import scipy.sparse as sp
+from scipy.sparse.linalg import splu
+from pandapower.pypower.idx_bus import VA, VM
+import contextlib
 import copy
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import shutil
 import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .base_cache import ArtifactCache, hash_base_inputs
+from .dataset_writer import ID_COLUMN, DatasetWriter, read_dataset
+from .fileio import replacing
+from .instrumentation import configure_logging, metrics
+from .load_sampling import JOINT_KINDS, LOAD_FACTORS, LoadSampler
+from .noisy_batches import STD_DEV_FILE, NoisyBatches, draw_noise, load_std_dev, save_std_dev
+from .scen_store import RES_COLUMNS, ScenarioStore, concat_stores, gather_meas, load_store, net2result, net_res, save_store
+from .seeds import run_seed, scen_seed
+from .sparse_h import SparseH, load_h, save_h
+
+logger = logging.getLogger(__name__)
 
 def get_pu_react4trafo(net, trafo):
     z_pu=(trafo['vk_percent']/100)*(net.sn_mva/trafo['sn_mva'])
@@ -11,230 +36,245 @@ def get_pu_react4trafo(net, trafo):
     return x_pu
 
 
-def gen_h4all(net):
+@metrics.timed('gen_h4all')
+def gen_h4all(net, dense=False):
     #Note: In the following, columns headers represent bus numbers sorted in ascending order
-    n_buses=len(net.bus) #no. of angles (states in dc model)=no. of buses (including slack bus)
-    data4pf=[]
-    labels4pf=[]
-    labels4pinj=[] #needed for power injection calculations
-
-    for line_id, row in net.line.iterrows():
-        line_row = np.zeros(n_buses)
-        this_imp_base=net.bus.loc[row['from_bus']]['vn_kv']**2//net.sn_mva
-        z_pu=(row['length_km']*row['x_ohm_per_km']/row['parallel'])/this_imp_base
-        b=1/z_pu 
-        line_row[row['from_bus']]=b #Convention as per Abur (not Mirsad), so injection will be negative sum
-        line_row[row['to_bus']]=-b
-        data4pf.append(line_row)
-        labels4pf.append('pfl'+str(line_id)+'_'+str(row['from_bus'])+'_'+str(row['to_bus']))
-        labels4pinj.append(row['from_bus'])
-        data4pf.append(-line_row)
-        labels4pf.append('pfl'+str(line_id)+'_'+str(row['to_bus'])+'_'+str(row['from_bus']))
-        labels4pinj.append(row['to_bus'])
-
-    for trafo_id, row in net.trafo.iterrows():
-        trafo_row = np.zeros(n_buses)
-        
-        z_pu=get_pu_react4trafo(net, row)
-        b=1/z_pu
-        trafo_row[row['lv_bus']]=b #lv bus in trafo is treated same as from bus in line since pu is calculated with ref to this side
-        trafo_row[row['hv_bus']]=-b
-        data4pf.append(trafo_row)
-        labels4pf.append('pft'+str(trafo_id)+'_'+str(row['lv_bus'])+'_'+str(row['hv_bus']))
-        labels4pinj.append(row['lv_bus'])
-        data4pf.append(-trafo_row)
-        labels4pf.append('pft'+str(trafo_id)+'_'+str(row['hv_bus'])+'_'+str(row['lv_bus']))
-        labels4pinj.append(row['hv_bus'])
-
-    data4pf=pd.DataFrame(data4pf)
-    labels4pf=pd.DataFrame(labels4pf, columns=['label'])
-    labels4pinj=pd.DataFrame(labels4pinj, columns=['from_bus'])
-    pf=pd.concat([labels4pinj,labels4pf,data4pf],axis=1)
-
-    labels4pinj=[]
-    data4pinj=[]
-    for bus_id in range(n_buses):
-        pf_per_bus=pf[pf['from_bus']==bus_id]
-        data4pinj.append(-pf_per_bus.iloc[:,2:].sum().values) #negative sum since injection is opposite to pf
-        labels4pinj.append('p'+str(bus_id))
-
-    labels4pinj=pd.DataFrame(labels4pinj, columns=['label'])
-    data4pinj=pd.DataFrame(data4pinj)
-    p=pd.concat([labels4pinj,data4pinj], axis=1)
-
-    pf=pf.drop('from_bus', axis=1)
-    h=pd.concat([pf,p],axis=0)
-    h.set_index('label', drop=True, inplace=True)
-
+    #Returns the DC measurement matrix of all branch flows (both directions) and bus injections as a SparseH.
+    #dense=True returns the former dense DataFrame view (index 'label', one column per bus)
+    bus_pos = net.bus.index.get_indexer #no. of angles (states in dc model)=no. of buses (including slack bus)
+
+    this_imp_base = net.bus['vn_kv'].loc[net.line['from_bus']].values**2/net.sn_mva
+    z_pu = (net.line['length_km']*net.line['x_ohm_per_km']/net.line['parallel']).values/this_imp_base
+    b_line = 1/z_pu
+    b_trafo = 1/get_pu_react4trafo(net, net.trafo).values
+
+    #lv bus in trafo is treated same as from bus in line since pu is calculated with ref to this side
+    from_bus = np.concatenate([net.line['from_bus'].values, net.trafo['lv_bus'].values]).astype(int)
+    to_bus = np.concatenate([net.line['to_bus'].values, net.trafo['hv_bus'].values]).astype(int)
+    b = np.concatenate([b_line, b_trafo])
+    from_pos = bus_pos(from_bus)
+    to_pos = bus_pos(to_bus)
+
+    #Each branch gives two flow rows: from->to (b at from, -b at to. Convention as per Abur (not Mirsad), so injection
+    #will be negative sum) followed by to->from (the negated row)
+    n_pf = 2*len(b)
+    rows = np.repeat(np.arange(n_pf), 2)
+    cols = np.column_stack([from_pos, to_pos, from_pos, to_pos]).ravel()
+    vals = np.column_stack([b, -b, -b, b]).ravel()
+    pf = sp.csr_matrix((vals, (rows, cols)), shape=(n_pf, len(net.bus)))
+
+    prefixes = ['pfl']*len(net.line) + ['pft']*len(net.trafo)
+    branch_ids = np.concatenate([net.line.index.values, net.trafo.index.values])
+    labels4pf = []
+    for prefix, branch_id, f, t in zip(prefixes, branch_ids, from_bus, to_bus):
+        labels4pf.append(prefix+str(branch_id)+'_'+str(f)+'_'+str(t))
+        labels4pf.append(prefix+str(branch_id)+'_'+str(t)+'_'+str(f))
+
+    #Injection at a bus is the negative sum of the flows leaving it (needed for power injection calculations)
+    origin = np.column_stack([from_pos, to_pos]).ravel()
+    leaving = sp.csr_matrix((np.ones(n_pf), (origin, np.arange(n_pf))), shape=(len(net.bus), n_pf))
+    p = -(leaving @ pf)
+    labels4pinj = ['p'+str(bus_id) for bus_id in net.bus.index]
+
+    h = SparseH(sp.vstack([pf, p], format='csr'), labels4pf+labels4pinj, net.bus.index)
+    if dense:
+        return h.to_frame()
     return h
 
 
+#Measurement groups in the order measurements are created: (element_type, meas_type, name prefix, result column per side)
+MEAS_GROUPS = [
+    ('bus', 'v', 'v', {None: ('res_bus', 'vm_pu')}), #Voltage Magnitudes at buses
+    ('bus', 'p', 'p', {None: ('res_bus', 'p_mw')}), #Active Power Injection at buses
+    ('bus', 'q', 'q', {None: ('res_bus', 'q_mvar')}), #Reactive Power Injection at buses
+    ('line', 'p', 'pfl', {'from': ('res_line', 'p_from_mw'), 'to': ('res_line', 'p_to_mw')}), #Active Power flows in lines
+    ('line', 'q', 'qfl', {'from': ('res_line', 'q_from_mvar'), 'to': ('res_line', 'q_to_mvar')}), #Reactive Power flows in lines
+    ('trafo', 'p', 'pft', {'lv': ('res_trafo', 'p_lv_mw'), 'hv': ('res_trafo', 'p_hv_mw')}), #Active Power flows in trafos
+    ('trafo', 'q', 'qft', {'lv': ('res_trafo', 'q_lv_mvar'), 'hv': ('res_trafo', 'q_hv_mvar')}), #Reactive Power flows in trafos
+]
 
-def gen_meas(net, all_meas,h4all, output_path, inst_err):
 
-    inst_err_v=0.5*inst_err
+def gen_meas_table(all_meas):
+    #Measurement table (as net.measurement, without values) of the picked rows of the template, in creation order
+    selected_meas = all_meas.loc[all_meas['meas_picked'] == True]
+    selected_meas = selected_meas.drop(['meas_picked'], axis=1)
 
-    h=[]
+    tables = []
+    for element_type, meas_type, prefix, res_columns in MEAS_GROUPS:
+        selected = selected_meas.loc[(selected_meas['element_type'] == element_type) & (selected_meas['meas_type'] == meas_type)]
+        if element_type == 'bus':
+            names = prefix + selected['element'].astype(str)
+            sides = np.full(len(selected), None, dtype=object)
+        else:
+            selected = selected.loc[selected['side'].isin(list(res_columns))] #other sides are not measured
+            names = (prefix + selected['element'].astype(str) + '_' + selected['side_idx'].astype(str) + '_' +
+                     selected['other_side_idx'].astype(str))
+            sides = selected['side'].values.astype(object)
+        tables.append(pd.DataFrame({'name': names.values,
+                                    'measurement_type': meas_type,
+                                    'element_type': element_type,
+                                    'element': selected['element'].values.astype(np.int64),
+                                    'value': np.nan,
+                                    'std_dev': np.nan,
+                                    'side': sides}))
+    return pd.concat(tables, ignore_index=True)
+
+
+def _append_measurements(net, meas_table):
+    #Bulk equivalent of calling pp.create_measurement for every row of meas_table
+    start = net.measurement.index.max() + 1 if len(net.measurement) else 0
+    meas_table = meas_table.set_axis(pd.RangeIndex(start, start + len(meas_table)))
+    meas_table = meas_table.astype(net.measurement.dtypes.to_dict())
+    if len(net.measurement):
+        meas_table = pd.concat([net.measurement, meas_table])
+    net.measurement = meas_table
+
+
+@metrics.timed('gen_meas')
+def gen_meas(net, all_meas,h4all, output_path, inst_err, h_formats=('npz',), sparse=False):
+    #h_formats: files written for h, h_reordered and h_no_slack, 'npz' (compressed sparse, see load_h) and/or 'csv' (dense)
+    #sparse: return the H matrices as SparseH instead of dense DataFrames
 
-    n_buses=len(net.bus)
+    inst_err_v=0.5*inst_err
 
-    selected_meas = all_meas.loc[all_meas['meas_picked'] == True]
-    n_meas = len(selected_meas)
-    selected_meas = selected_meas.drop(['meas_picked'], axis=1)
+    logger.info('Generating measurements for net..')
+    meas_table = gen_meas_table(all_meas)
+    for element_type in ['bus', 'line', 'trafo']:
+        elements = meas_table.loc[meas_table['element_type'] == element_type, 'element']
+        missing = elements[~elements.isin(net[element_type].index)]
+        if not missing.empty:
+            raise UserWarning('{} with index={} does not exist'.format(element_type, missing.iloc[0]))
+    first_new = len(net.measurement)
+    _append_measurements(net, meas_table)
+    update_meas(net)
+    new_meas = net.measurement.iloc[first_new:]
+    err = np.where(new_meas['measurement_type'] == 'v', inst_err_v, inst_err)
+    net.measurement.loc[new_meas.index, 'std_dev'] = np.abs(err*new_meas['value'].values)
+
+    h, h_reordered, h_no_slack = meas_h(net, h4all, meas_table, sparse)
+    write_h(output_path, h_formats, h=h, h_reordered=h_reordered, h_no_slack=h_no_slack)
+    save_std_dev(net.measurement['name'].values, net.measurement['std_dev'].values, output_path + STD_DEV_FILE) #for NoisyBatches
+    
+    logger.info('Done!')
+    return h, h_reordered, h_no_slack #net include the new tables reulting from creating measurements
 
-    selected_buses=selected_meas.loc[selected_meas['element_type']=='bus']
-    selected_buses_v = selected_buses.loc[selected_buses['meas_type'] == 'v']
-    selected_buses_p = selected_buses.loc[selected_buses['meas_type'] == 'p']
-    selected_buses_q = selected_buses.loc[selected_buses['meas_type'] == 'q']
-
-    selected_lines=selected_meas.loc[selected_meas['element_type']=='line']
-    selected_lines_p = selected_lines.loc[selected_lines['meas_type'] == 'p']
-    selected_lines_q = selected_lines.loc[selected_lines['meas_type'] == 'q']
-
-    selected_trafos=selected_meas.loc[selected_meas['element_type']=='trafo']
-    selected_trafos_p = selected_trafos.loc[selected_trafos['meas_type'] == 'p']
-    selected_trafos_q = selected_trafos.loc[selected_trafos['meas_type'] == 'q']
-
-
-    print('Generating measurements for net..')
-    cnt=-1
-
-    #Voltage Magnitudes at buses
-    if not selected_buses_v.empty:
-        for index, row in selected_buses_v.iterrows():
-            element=row['element']
-            value=net.res_bus['vm_pu'].loc[element]
-            name='v' + str(element)
-            cnt+=1
-            pp.create_measurement(net, 'v','bus',value,np.abs(inst_err_v*value),element, name=name)
-            dummy_row=pd.DataFrame(np.zeros(n_buses), columns=[name]).T
-            h.append(dummy_row)
-
-
-    #Active Power Injection at buses
-    if not selected_buses_p.empty:
-        for index, row in selected_buses_p.iterrows():
-            element=row['element']
-            value=net.res_bus['p_mw'].loc[element]
-            name='p'+str(element)
-            cnt+=1
-            pp.create_measurement(net, 'p','bus',value,np.abs(inst_err*value),element, name=name)
-            real_row = pd.DataFrame(h4all.loc[name].values, columns=[name]).T
-            h.append(real_row)
-
-    #Reactive Power Injection at buses
-    if not selected_buses_q.empty:
-        for index, row in selected_buses_q.iterrows():
-            element=row['element']
-            value=net.res_bus['q_mvar'].loc[element]
-            name = 'q' + str(element)
-            cnt+=1
-            pp.create_measurement(net, 'q','bus',value,np.abs(inst_err*value),element, name=name)
-            dummy_row=pd.DataFrame(np.zeros(n_buses), columns=[name]).T
-            h.append(dummy_row)
-
-    #Active Power flows in lines
-    if not selected_lines_p.empty:
-        for index, row in selected_lines_p.iterrows():
-            element=row['element']
-            side=row['side']
-            side_id = row['side_idx']
-            other_side_id = row['other_side_idx']
-            name = 'pfl' +str(element)+'_'+ str(side_id) + '_' + str(other_side_id)
-            if side=='from':
-                value=net.res_line['p_from_mw'].loc[element]
-                cnt += 1
-                pp.create_measurement(net, 'p','line',value,np.abs(inst_err*value),element, side, name=name)
-                real_row = pd.DataFrame(h4all.loc[name].values, columns=[name]).T
-                h.append(real_row)
-            elif side=='to':
-                value = net.res_line['p_to_mw'].loc[element]
-                cnt += 1
-                pp.create_measurement(net, 'p', 'line', value,np.abs(inst_err*value), element, side,name=name)
-                real_row = pd.DataFrame(h4all.loc[name].values, columns=[name]).T
-                h.append(real_row)
-
-    # Reactive Power flows in lines
-    if not selected_lines_q.empty:
-        for index, row in selected_lines_q.iterrows():
-            element=row['element']
-            side=row['side']
-            side_id = row['side_idx']
-            other_side_id = row['other_side_idx']
-            name = 'qfl' +str(element)+'_'+ str(side_id) + '_' + str(other_side_id)
-            if side=='from':
-                value=net.res_line['q_from_mvar'].loc[element]
-                cnt += 1
-                pp.create_measurement(net, 'q','line',value,np.abs(inst_err*value),element, side,name=name)
-                dummy_row = pd.DataFrame(np.zeros(n_buses), columns=[
-                    name]).T  
-                h.append(dummy_row)
-            elif side=='to':
-                value = net.res_line['q_to_mvar'].loc[element]
-                cnt += 1
-                pp.create_measurement(net, 'q', 'line', value,np.abs(inst_err*value), element, side,name=name)
-                dummy_row = pd.DataFrame(np.zeros(n_buses), columns=[
-                    name]).T  
-                h.append(dummy_row)
-
-
-    # Active Power flows in trafos
-    if not selected_trafos_p.empty:
-        for index, row in selected_trafos_p.iterrows():
-            element=row['element']
-            side=row['side']
-            side_id = row['side_idx']
-            other_side_id = row['other_side_idx']
-            name = 'pft' +str(element)+'_'+ str(side_id) + '_' + str(other_side_id)
-            if side=='lv':
-                value=net.res_trafo['p_lv_mw'].loc[element]
-                cnt += 1
-                pp.create_measurement(net, 'p','trafo',value,np.abs(inst_err*value),element, side,name=name)
-                real_row = pd.DataFrame(h4all.loc[name].values, columns=[name]).T
-                h.append(real_row)
-
-            elif side=='hv':
-                value = net.res_trafo['p_hv_mw'].loc[element]
-                cnt += 1
-                pp.create_measurement(net, 'p', 'trafo', value,np.abs(inst_err*value), element, side,name=name)
-                real_row = pd.DataFrame(h4all.loc[name].values, columns=[name]).T
-                h.append(real_row)
-
-
-    # Reactive Power flows in trafos
-    if not selected_trafos_q.empty:
-        for index, row in selected_trafos_q.iterrows():
-            element=row['element']
-            side=row['side']
-            side_id = row['side_idx']
-            other_side_id = row['other_side_idx']
-            name = 'qft'+str(element)+'_' + str(side_id) + '_' + str(other_side_id)
-            if side=='lv':
-                value=net.res_trafo['q_lv_mvar'].loc[element]
-                cnt += 1
-                pp.create_measurement(net, 'q','trafo',value,np.abs(inst_err*value),element, side,name=name)
-                dummy_row = pd.DataFrame(np.zeros(n_buses), columns=[
-                    name]).T  
-                h.append(dummy_row)
-            elif side=='hv':
-                value = net.res_trafo['q_hv_mvar'].loc[element]
-                cnt += 1
-                pp.create_measurement(net, 'q', 'trafo', value,np.abs(inst_err*value), element, side,name=name)
-                dummy_row = pd.DataFrame(np.zeros(n_buses), columns=[
-                    name]).T  
-                h.append(dummy_row)
-
-
-    h=pd.concat(h)
-    h.to_csv(output_path+'h.csv')
+DATASET_NAMES = ['source_clean_meas', 'target_gt_states', 'source_noisy_meas']
+SHARD_FILE = 'shard.json' #run parameters and scenario range of the datasets written by write_datasets
+def meas_h(net, h4all, meas_table=None, sparse=False):
+    #h, h_reordered and h_no_slack of the measurements (all of net.measurement if meas_table is None) taken from h4all,
+    #e.g. from the h4all of an outage case (see gen_outage_h). Dense DataFrames, or SparseH with sparse=True
+    if meas_table is None:
+        meas_table = net.measurement
+    n_buses = len(net.bus)
+    #H rows: rows of h4all for active power (flows and injections), zero rows otherwise (dc model)
+    names = meas_table['name'].values
+    is_p = (meas_table['measurement_type'] == 'p').values
+    gt_pos = pd.RangeIndex(n_buses).get_indexer(net.res_bus.index) #columns of h in GT ordering
+    if sparse and (gt_pos >= 0).all():
+        p_rows = h4all.rows(names[is_p]) if isinstance(h4all, SparseH) else sp.csr_matrix(h4all.loc[names[is_p]].values)
+        select = sp.csr_matrix((np.ones(is_p.sum()), (np.flatnonzero(is_p), np.arange(is_p.sum()))),
+                               shape=(len(meas_table), p_rows.shape[0]))
+        h = SparseH(select @ p_rows, names, pd.RangeIndex(n_buses))
+        h_reordered = SparseH(h.matrix[:, gt_pos], names, net.res_bus.index)
+        keep = ~net.res_bus.index.isin(net.ext_grid.bus.values)
+        h_no_slack = SparseH(h_reordered.matrix[:, np.flatnonzero(keep)], names, net.res_bus.index[keep])
+        return h, h_reordered, h_no_slack
+
+    h = np.zeros((len(meas_table), n_buses))
+    if is_p.any():
+        if isinstance(h4all, SparseH):
+            h[is_p] = h4all.rows(names[is_p]).toarray()
+        else:
+            h[is_p] = h4all.loc[names[is_p]].values
+    h = pd.DataFrame(h, index=names, columns=pd.RangeIndex(n_buses))
     h_reordered=h.T
     h_reordered=h_reordered.reindex(net.res_bus.index).T #Reorder columns of h to match GT ordering
-    h_reordered.to_csv(output_path+'h_reordered.csv')
     h_no_slack = h_reordered.drop(net.ext_grid.bus.values, axis=1)
-    h_no_slack.to_csv(output_path + 'h_no_slack.csv')
-    
-    print('Done!')
-    return h, h_reordered, h_no_slack #net include the new tables reulting from creating measurements
+    if sparse: #bus indices that are not positions, the reindexed columns are NaN as in the dense H
+        return tuple(SparseH.from_frame(frame) for frame in (h, h_reordered, h_no_slack))
+    return h, h_reordered, h_no_slack
+
+
+def as_h(h, sparse):
+    #H as SparseH or as dense DataFrame (the layout of meas_h and of the csv files)
+    if sparse:
+        return h if isinstance(h, SparseH) else SparseH.from_frame(h)
+    return h.to_frame().rename_axis(None) if isinstance(h, SparseH) else h
+
+
+H_FILES = ['h', 'h_reordered', 'h_no_slack']
+def h_files(h_formats):
+    return ['{}.{}'.format(name, file_format) for file_format in h_formats for name in H_FILES]
+
+
+def write_h(output_path, h_formats, **h):
+    #Writes H matrices keyed by name (h, h_reordered, h_no_slack) as output_path + name.npz (save_h) and/or .csv
+    for file_format in h_formats:
+        if file_format not in ('npz', 'csv'):
+            raise ValueError('H files shall be written as npz or csv, got {!r}'.format(file_format))
+    for name, matrix in h.items():
+        if 'npz' in h_formats:
+            save_h(matrix, output_path + name + '.npz')
+        if 'csv' in h_formats:
+            with replacing(output_path + name + '.csv') as tmp:
+                as_h(matrix, sparse=False).to_csv(tmp)
+
+
+def gen_outage_h(net, h4all, element_type, element):
+    #h4all of the grid with one line or trafo out of service: the flow rows of the branch are zero and its susceptance is
+    #removed from the injection rows (the H matching the DC contingency scenarios of that outage)
+    if isinstance(h4all, pd.DataFrame):
+        h4all = SparseH(h4all.values, h4all.index, h4all.columns)
+    row, b, from_pos, to_pos = _h4all_branch(net, h4all, element_type, element)
+    p_from, p_to = h4all.positions(['p'+str(bus_id) for bus_id in net.bus.index[[from_pos, to_pos]]])
+    delta = sp.csr_matrix(([-b, b, b, -b, b, -b, -b, b],
+                           ([row, row, row + 1, row + 1, p_from, p_from, p_to, p_to],
+                            [from_pos, to_pos, from_pos, to_pos, from_pos, to_pos, from_pos, to_pos])),
+                          shape=h4all.shape)
+    matrix = h4all.matrix + delta
+    matrix.eliminate_zeros()
+    return SparseH(matrix, h4all.labels, h4all.columns)
+
+
+@metrics.timed('prepare_base_net')
+def prepare_base_net(net, all_meas, output_path, inst_err, cache_path=None, max_cache_bytes=2**30, h_formats=('npz',),
+                     sparse=False):
+    #Solved base net with measurements and H: pp.runpp, gen_h4all and gen_meas (H files written to output_path in
+    #h_formats, H returned as SparseH with sparse). With
+    #cache_path (e.g. '../runs/cache/'), all of it is cached under a hash of the grid tables, the template and inst_err, and
+    #repeated runs on the same inputs load it instead; the cache keeps at most max_cache_bytes (least recently used
+    #entries are evicted). Returns net, h4all, h, h_reordered, h_no_slack. Use the returned net: on a cache hit, net is the
+    #cached copy and the given one is left untouched.
+    files = h_files(h_formats) + [STD_DEV_FILE] #written by gen_meas to output_path
+    if cache_path is not None:
+        cache = ArtifactCache(cache_path, max_cache_bytes)
+        key = hash_base_inputs(net, all_meas, inst_err)
+        cached = cache.load(key)
+        if cached is not None:
+            entry = cache.entry_path(key)
+            for name in files:
+                if os.path.exists(os.path.join(entry, name)):
+                    with replacing(output_path + name) as tmp: #shards of a run share output_path
+                        shutil.copyfile(os.path.join(entry, name), tmp)
+                elif name == STD_DEV_FILE:
+                    measurement = cached['net'].measurement
+                    save_std_dev(measurement['name'].values, measurement['std_dev'].values, output_path + name)
+                else: #cached with other h_formats
+                    base, file_format = name.rsplit('.', 1)
+                    write_h(output_path, (file_format,), **{base: cached[base]})
+            logger.info('prepare_base_net: Base net, measurements and H loaded from cache (%s)', key[:12])
+            metrics.count('base_cache_hits')
+            return (cached['net'], cached['h4all'],
+                    *(as_h(cached[name], sparse) for name in H_FILES))
+
+    pp.runpp(net)
+    h4all = gen_h4all(net)
+    h, h_reordered, h_no_slack = gen_meas(net, all_meas, h4all, output_path, inst_err, h_formats, sparse)
+    if cache_path is not None:
+        cache.store(key, {'net': net, 'h4all': h4all, 'h': h, 'h_reordered': h_reordered, 'h_no_slack': h_no_slack},
+                    {name: output_path + name for name in files})
+        metrics.count('base_cache_misses')
+    return net, h4all, h, h_reordered, h_no_slack
 
 
 
@@ -242,119 +282,750 @@ def gen_meas(net, all_meas,h4all, output_path, inst_err):
 ###########################################################
 
 
-def update_meas(net):
-
-    select_buses_v = (net.measurement['element_type'] == 'bus') & (net.measurement['measurement_type'] == 'v')
-
-    select_buses_p = (net.measurement['element_type'] == 'bus') & (net.measurement['measurement_type'] == 'p')
-
-    select_buses_q = (net.measurement['element_type'] == 'bus') & (net.measurement['measurement_type'] == 'q')
-
-    select_lines_p_from=(net.measurement['element_type'] == 'line') & (net.measurement['measurement_type'] == 'p') & (net.measurement['side'] == 'from')
-    select_lines_p_to=(net.measurement['element_type'] == 'line') & (net.measurement['measurement_type'] == 'p') & (net.measurement['side'] == 'to')
-    select_lines_q_from=(net.measurement['element_type'] == 'line') & (net.measurement['measurement_type'] == 'q') & (net.measurement['side'] == 'from')
-    select_lines_q_to=(net.measurement['element_type'] == 'line') & (net.measurement['measurement_type'] == 'q') & (net.measurement['side'] == 'to')
-
-    select_trafos_p_lv = (net.measurement['element_type'] == 'trafo') & (net.measurement['measurement_type'] == 'p') & (net.measurement['side'] == 'lv')
-    select_trafos_p_hv = (net.measurement['element_type'] == 'trafo') & (net.measurement['measurement_type'] == 'p') & (net.measurement['side'] == 'hv')
-    select_trafos_q_lv = (net.measurement['element_type'] == 'trafo') & (net.measurement['measurement_type'] == 'q') & (net.measurement['side'] == 'lv')
-    select_trafos_q_hv = (net.measurement['element_type'] == 'trafo') & (net.measurement['measurement_type'] == 'q') & (net.measurement['side'] == 'hv')
-
-
-    # Voltage Magnitudes at buses
-    if not net.measurement[select_buses_v].empty:
-        elements=net.measurement[select_buses_v]['element']
-        net.measurement.loc[select_buses_v,'value']=net.res_bus.loc[elements]['vm_pu'].values #VIMP TIP to update pandas cells based on selection
-
-    # Active Power Injection at buses
-    if not net.measurement[select_buses_p].empty:
-        elements=net.measurement[select_buses_p]['element']
-        net.measurement.loc[select_buses_p,'value'] =net.res_bus.loc[elements]['p_mw'].values
-
-    # Reactive Power Injection at buses
-    if not net.measurement[select_buses_q].empty:
-        elements = net.measurement[select_buses_q]['element']
-        net.measurement.loc[select_buses_q,'value'] = net.res_bus.loc[elements]['q_mvar'].values
-
-    # Active Power flows in lines (from)
-    if not net.measurement[select_lines_p_from].empty:
-        elements = net.measurement[select_lines_p_from]['element']
-        net.measurement.loc[select_lines_p_from,'value'] = net.res_line.loc[elements]['p_from_mw'].values
-
-    # Active Power flows in lines (to)
-    if not net.measurement[select_lines_p_to].empty:
-        elements = net.measurement[select_lines_p_to]['element']
-        net.measurement.loc[select_lines_p_to,'value'] = net.res_line.loc[elements]['p_to_mw'].values
-
-    # Reactive Power flows in lines (from)
-    if not net.measurement[select_lines_q_from].empty:
-        elements = net.measurement[select_lines_q_from]['element']
-        net.measurement.loc[select_lines_q_from,'value'] = net.res_line.loc[elements]['q_from_mvar'].values
-
-    # Reactive Power flows in lines (to)
-    if not net.measurement[select_lines_q_to].empty:
-        elements = net.measurement[select_lines_q_to]['element']
-        net.measurement.loc[select_lines_q_to,'value'] = net.res_line.loc[elements]['q_to_mvar'].values
-
-    # Active Power flows in trafos (lv)
-    if not net.measurement[select_trafos_p_lv].empty:
-        elements = net.measurement[select_trafos_p_lv]['element']
-        net.measurement.loc[select_trafos_p_lv,'value'] = net.res_trafo.loc[elements]['p_lv_mw'].values
-
-    # Active Power flows in trafos (hv)
-    if not net.measurement[select_trafos_p_hv].empty:
-        elements = net.measurement[select_trafos_p_hv]['element']
-        net.measurement.loc[select_trafos_p_hv,'value'] = net.res_trafo.loc[elements]['p_hv_mw'].values
-
-    # Reactive Power flows in trafos (lv)
-    if not net.measurement[select_trafos_q_lv].empty:
-        elements = net.measurement[select_trafos_q_lv]['element']
-        net.measurement.loc[select_trafos_q_lv,'value'] = net.res_trafo.loc[elements]['q_lv_mvar'].values
-
-    # Reactive Power flows in trafos (hv)
-    if not net.measurement[select_trafos_q_hv].empty:
-        elements = net.measurement[select_trafos_q_hv]['element']
-        net.measurement.loc[select_trafos_q_hv,'value'] = net.res_trafo.loc[elements]['q_hv_mvar'].values
-
+def compile_meas_map(net):
+    #Compiles the measurement-to-result mapping of net.measurement once: one entry per result column with the flat integer
+    #positions of its measurements and of the measured elements in the result table, [(table, column, meas_pos, element_pos)]
+    element_type = net.measurement['element_type'].values
+    meas_type = net.measurement['measurement_type'].values
+    side = net.measurement['side'].values
+    element = net.measurement['element'].values
+
+    meas_map = []
+    for group_element_type, group_meas_type, _, res_columns in MEAS_GROUPS:
+        in_group = (element_type == group_element_type) & (meas_type == group_meas_type)
+        for group_side, (table, column) in res_columns.items():
+            selected = in_group if group_side is None else in_group & (side == group_side)
+            if not selected.any():
+                continue
+            element_pos = net[group_element_type].index.get_indexer(element[selected])
+            if (element_pos < 0).any():
+                raise KeyError('{} with index={} does not exist'.format(group_element_type, element[selected][element_pos < 0][0]))
+            meas_map.append((table, column, np.flatnonzero(selected), element_pos))
+    return meas_map
+
+
+def update_meas(net, meas_map=None):
+    #meas_map from compile_meas_map may be passed to skip recompiling it when the measurements do not change
+    if meas_map is None:
+        meas_map = compile_meas_map(net)
+    values = net.measurement['value'].values.copy()
+    gather_meas(meas_map, net_res(net, meas_map), values)
+    net.measurement['value'] = values
     return
 
 
 
-def gen_clean_scen_unfrm(base_net, n_l_scenarios,set_id):
-    print('gen_clean_scen_unfrm: Generating BASE CLEAN scenario 0 ... ')
-    nets = [copy.deepcopy(base_net)]  # construct a list holding all scenarios including base scenario
-    nets_ids=[set_id+str(0)]
-    this_net = copy.deepcopy(base_net)
-
-    n_loads = len(this_net.load)
-    print('\n')
-    for i in range(n_l_scenarios - 1):
-        print('Generating CLEAN scenario No. {:3}... '.format(i + 1))
-        # delta_P = np.random.normal(0, l_scenarios_std_dev, n_loads) # use these if you are interested in Gaussian variation of load. Preferably, define a new function for that.
-        # delta_Q = np.random.normal(0, l_scenarios_std_dev, n_loads)
-        factor = np.random.uniform(0.1, 1.1,
-                                   n_loads)  # samples vector of length n_loads with values from 0.1(included) to 1.1 (excluded)
-        this_net.load['p_mw'] = this_net.load['p_mw'] * factor
-        this_net.load['q_mvar'] = this_net.load['q_mvar'] * factor
-        #carry out pfa for each clean net and update meas
-        print('Running Power Flow Analysis for net {:3}'.format(i + 1))
-
-        pp.runpp(this_net)
-
-
-        print('Updating measurements of net {:3}'.format(i + 1))
-        update_meas(this_net)
-
-        nets.append(this_net)  # nets.append(copy.deepcopy(this_net))
-        nets_ids.append(set_id+str(i+1))
-
-        this_net = copy.deepcopy(base_net)  
-
-    return  nets_ids,nets
-
+def shard_range(n_l_scenarios, shard=None, scen_range=None):
+    #Scenario indices first..stop-1 computed by one shard of a run of n_l_scenarios: shard=(k, N) is the k-th (from 0) of
+    #N contiguous blocks of (almost) equal size, scen_range=(first, stop) an explicit block. Since every scenario is seeded
+    #from seed, set_id and its index, a shard computes exactly the scenarios of the single run.
+    if shard is not None and scen_range is not None:
+        raise ValueError('Give either shard or scen_range, not both')
+    if shard is not None:
+        k, n_shards = shard
+        if not 0 <= k < n_shards:
+            raise ValueError('Shard {} of {} does not exist (shards are numbered from 0)'.format(k, n_shards))
+        return k*n_l_scenarios//n_shards, (k + 1)*n_l_scenarios//n_shards
+    if scen_range is not None:
+        first, stop = scen_range
+        if not 0 <= first <= stop <= n_l_scenarios:
+            raise ValueError('Scenario range {}..{} is not within 0..{}'.format(first, stop, n_l_scenarios))
+        return first, stop
+    return 0, n_l_scenarios
+
+
+def _shard_seed(seed, shard, scen_range, caller):
+    if seed is None and (shard is not None or scen_range is not None): #shards on different machines must share the seed
+        raise ValueError('{}: a seed is required to generate a shard'.format(caller))
+    return run_seed(seed, caller)
+
+
+RESAMPLES_PER_SCENARIO = 10 #default max_resamples of RetryPolicy, and run budget per scenario
+
+
+class RetryPolicy:
+    #Fallback chain of an AC scenario whose power flow fails: the power flow of AcScenarioRunner (recycled) first, then a
+    #cold start (init='dc') with each of algorithms, then new load factors for the same scenario (LoadSampler.resample),
+    #each tried with the whole chain again, until one converges or max_resamples is reached (None: no limit per scenario,
+    #so one hard scenario may take the whole run budget). max_iteration caps the NR iterations of every power flow ('auto'
+    #keeps the pandapower default) and time_budget [s] the wall time of a scenario. The whole run is capped by
+    #run_max_resamples resamples (None: RESAMPLES_PER_SCENARIO per scenario of the run) and run_time_budget [s] (see
+    #RunBudget). Budgets are checked between attempts, a running power flow is not interrupted.
+
+    def __init__(self, algorithms=('iwamoto_nr',), max_resamples=RESAMPLES_PER_SCENARIO, max_iteration='auto',
+                 time_budget=None, run_max_resamples=None, run_time_budget=None):
+        self.algorithms = tuple(algorithms)
+        self.max_resamples = max_resamples
+        self.max_iteration = max_iteration
+        self.time_budget = time_budget
+        self.run_max_resamples = run_max_resamples
+        self.run_time_budget = run_time_budget
+
+    @classmethod
+    def from_params(cls, params):
+        #RetryPolicy from its parameters (dict), an existing policy, None (default chain) or False (no retries)
+        if params is False:
+            return None
+        if params is None:
+            return cls()
+        if isinstance(params, RetryPolicy):
+            return params
+        return cls(**params)
+
+    def stages(self):
+        return [None] + list(self.algorithms) #None: the power flow of the runner (recycled, see warm_start)
+
+
+class RunBudget:
+    #Resamples and wall time left to a whole run, shared by the runners of all its workers (the counter lives in shared
+    #memory). Once it is used up, the scenarios that still fail are reported as failed; which ones then depends on the
+    #order in which the workers reach them.
+
+    def __init__(self, max_resamples=None, time_budget=None):
+        self.max_resamples = max_resamples
+        self.deadline = None if time_budget is None else time.time() + time_budget
+        self.used = multiprocessing.Value('q', 0)
+
+    def take(self):
+        #Counts one resample, returns why it is refused (None if granted)
+        if self.deadline is not None and time.time() > self.deadline:
+            return 'run time budget exceeded'
+        with self.used.get_lock():
+            if self.max_resamples is not None and self.used.value >= self.max_resamples:
+                return 'run budget of {} resamples used up'.format(self.max_resamples)
+            self.used.value += 1
+        return None
+
+
+class AcScenarioRunner:
+    #Solves load scenarios on one working copy of the base net (only its loads are overwritten, no deep copy per scenario).
+    #warm_start='base' or 'nearest' recycles the converted ppc (Ybus and Jacobian structure) between scenarios, which is
+    #where the time is saved, and starts Newton-Raphson from the base case solution or from the solved scenario with the
+    #nearest load factors (pandapower ignores init with recycle). 'base' is not a better start than the DC init of plain
+    #pp.runpp (about one NR iteration more, e.g. 4 vs 3 on case118 and 5 vs 4 on case1354pegase) but keeps results
+    #independent of the order in which a worker solves its scenarios; 'nearest' needs as many iterations as pp.runpp.
+    #warm_start=None runs plain pp.runpp.
+    #retry (a RetryPolicy or its parameters, see RetryPolicy.from_params) handles scenarios that fail; new load factors
+    #are drawn by sampler from seed and set_id, within budget (a RunBudget shared with the other workers of the run, one of
+    #retry.run_max_resamples resamples if None). Scenarios solved at the first attempt are not affected by retry.
+
+    def __init__(self, base_net, warm_start='base', n_nearest=64, retry=False, sampler=None, seed=None, set_id='',
+                 budget=None):
+        if warm_start not in (None, 'base', 'nearest'):
+            raise ValueError("warm_start shall be None, 'base' or 'nearest', got {!r}".format(warm_start))
+        self.retry = RetryPolicy.from_params(retry)
+        self.sampler = LoadSampler.from_params(sampler)
+        self.seed = seed
+        self.set_id = set_id
+        if budget is None and self.retry is not None:
+            budget = RunBudget(self.retry.run_max_resamples, self.retry.run_time_budget)
+        self.budget = budget
+        self.net = copy.deepcopy(base_net)
+        self.base_load = {'p_mw': base_net.load['p_mw'].values.copy(), 'q_mvar': base_net.load['q_mvar'].values.copy()}
+        self.meas_map = compile_meas_map(base_net)
+        self.warm_start = warm_start if self.net.get('_ppc') else None #needs a converted (solved) base net
+        if self.warm_start is not None:
+            self.base_solution = (np.ones(len(base_net.load)),) + self._ppc_voltages()
+            self.solved = deque(maxlen=n_nearest)
+        #fallback power flows run on their own copy, so the recycled ppc of self.net (and the results of the following
+        #scenarios) does not depend on earlier failures
+        self.fallback_net = copy.deepcopy(base_net) if self.retry is not None and self.retry.algorithms else None
+
+    def _ppc_voltages(self):
+        return self.net._ppc['bus'][:, VM].copy(), self.net._ppc['bus'][:, VA].copy()
+
+    def _set_start(self, factor):
+        start = self.base_solution
+        if self.warm_start == 'nearest' and self.solved:
+            candidates = [self.base_solution] + list(self.solved)
+            distances = [np.linalg.norm(candidate[0] - factor) for candidate in candidates]
+            start = candidates[int(np.argmin(distances))]
+        self.net._ppc['bus'][:, VM] = start[1]
+        self.net._ppc['bus'][:, VA] = start[2]
+
+    def _runpp(self, factor, algorithm=None):
+        #Power flow with the given load factors, either as configured on self.net (algorithm None) or as a cold start with
+        #algorithm on self.fallback_net. Returns the error, None if converged.
+        net = self.net if algorithm is None else self.fallback_net
+        net.load['p_mw'] = self.base_load['p_mw'] * factor
+        net.load['q_mvar'] = self.base_load['q_mvar'] * factor
+        kwargs = {}
+        if algorithm is not None:
+            kwargs.update(algorithm=algorithm, init='dc')
+        elif self.warm_start is not None:
+            self._set_start(factor)
+            kwargs['recycle'] = dict(trafo=False, gen=False, bus_pq=True) #only bus PQ values change between scenarios
+        if self.retry is not None and self.retry.max_iteration != 'auto':
+            kwargs['max_iteration'] = self.retry.max_iteration
+        try:
+            with contextlib.redirect_stdout(None) if algorithm is not None else contextlib.nullcontext(): #iwamoto_nr prints every step
+                pp.runpp(net, **kwargs)
+        except Exception as err: #non-converged (LoadflowNotConverged) or otherwise failed scenario is reported back, not raised
+            return repr(err)
+        return None
+
+    def run(self, scen_idx, factor):
+        #Returns scen_idx, the result (None if all attempts failed), the error and the rejections of the scenario, converged
+        #or not: {'rejected': stage of the fallback chain ('runpp' or an algorithm) of every failed attempt, 'resamples':
+        #new load factors drawn}.
+        pf_start = time.perf_counter()
+        tried = {'rejected': [], 'resamples': 0}
+        rejected = tried['rejected']
+        chain = self.retry.stages() if self.retry is not None else [None]
+        for resample in itertools.count():
+            if resample:
+                if self.retry is None or (self.retry.max_resamples is not None and resample > self.retry.max_resamples):
+                    break
+                refused = self.budget.take()
+                if refused is not None:
+                    return scen_idx, None, '{} after {} attempts, last error: {}'.format(refused, len(rejected), err), tried
+                factor = self.sampler.resample(self.seed, self.set_id, scen_idx, resample, len(factor))
+                tried['resamples'] = resample
+            for algorithm in chain:
+                if (rejected and self.retry.time_budget is not None and
+                        time.perf_counter() - pf_start > self.retry.time_budget):
+                    return scen_idx, None, 'time budget of {} s exceeded after {} attempts, last error: {}'.format(
+                        self.retry.time_budget, len(rejected), err), tried
+                #carry out pfa for each clean net and update meas
+                err = self._runpp(factor, algorithm)
+                if err is None:
+                    return scen_idx, self._result(self.net if algorithm is None else self.fallback_net, factor, pf_start,
+                                                  rejected), None, tried
+                rejected.append(algorithm or 'runpp')
+        return scen_idx, None, err if len(rejected) == 1 else '{} (after {} attempts)'.format(err, len(rejected)), tried
+
+    def _result(self, net, factor, pf_start, rejected):
+        result = net2result(net, factor, self.meas_map) #measurements go straight into the result, not net.measurement
+        result['iterations'] = int(net._ppc['iterations'])
+        result['pf_time'] = time.perf_counter() - pf_start
+        result['attempts'] = len(rejected) + 1
+        if self.warm_start == 'nearest' and net is self.net:
+            self.solved.append((factor,) + self._ppc_voltages())
+        return result
+
+
+_worker_runner = None #AcScenarioRunner of each worker process (base net sent once by the pool initializer)
+
+def _init_scen_worker(base_net, warm_start, retry=False, sampler=None, seed=None, set_id='', budget=None):
+    global _worker_runner
+    _worker_runner = AcScenarioRunner(base_net, warm_start, retry=retry, sampler=sampler, seed=seed, set_id=set_id,
+                                      budget=budget)
+    return _worker_runner
+
+def _run_load_scenario_in_worker(task):
+    scen_idx, factor = task
+    return _worker_runner.run(scen_idx, factor)
+
+
+def branch_outages(net, element_types=('line', 'trafo')):
+    #(element_type, index) of every in-service line and trafo, the default N-1 contingency list
+    return [(element_type, element) for element_type in element_types
+            for element in net[element_type].index[net[element_type]['in_service'].values.astype(bool)]]
+
+
+def outage_label(outage):
+    return '' if outage is None else '{}{}'.format(*outage)
+
+
+class AcContingencyRunner:
+    #Solves the intact case of a load scenario (AcScenarioRunner) and then each branch outage on a second working copy of
+    #the net, starting Newton-Raphson from the intact solution of the same loads (init='results'). Outages that leave
+    #isolated buses are reported as failed.
+
+    def __init__(self, base_net, outages, warm_start='base'):
+        self.intact = AcScenarioRunner(base_net, warm_start)
+        self.net = copy.deepcopy(base_net)
+        self.outages = outages
+        self.base_res_bus = base_net.res_bus[['vm_pu', 'va_degree']].values.copy()
+        self.base_result = net2result(base_net, np.ones(len(base_net.load)), self.intact.meas_map)
+
+    def run(self, scen_idx, factor):
+        #Returns scen_idx and [(outage label, result or None, error)] of the intact case followed by the outages
+        if scen_idx == 0: #base scenario, intact case already solved
+            factor = np.ones(len(self.net.load))
+            intact, err, start = self.base_result, None, self.base_res_bus
+        else:
+            _, intact, err, _ = self.intact.run(scen_idx, factor)
+            start = self.intact.net.res_bus[['vm_pu', 'va_degree']].values.copy()
+        results = [('', intact, err)]
+        if intact is None:
+            return scen_idx, results + [(outage_label(outage), None, 'intact case failed') for outage in self.outages]
+
+        self.net.load['p_mw'] = self.intact.base_load['p_mw'] * factor
+        self.net.load['q_mvar'] = self.intact.base_load['q_mvar'] * factor
+        for element_type, element in self.outages:
+            self.net.res_bus[['vm_pu', 'va_degree']] = start
+            self.net[element_type].at[element, 'in_service'] = False
+            pf_start = time.perf_counter()
+            try:
+                pp.runpp(self.net, init='results')
+                if self.net.res_bus['vm_pu'].isna().any():
+                    raise RuntimeError('{} out of service leaves isolated buses'.format(outage_label((element_type, element))))
+            except Exception as err:
+                results.append((outage_label((element_type, element)), None, repr(err)))
+                continue
+            finally:
+                self.net[element_type].at[element, 'in_service'] = True
+            result = net2result(self.net, factor, self.intact.meas_map)
+            result['iterations'] = int(self.net._ppc['iterations'])
+            result['pf_time'] = time.perf_counter() - pf_start
+            results.append((outage_label((element_type, element)), result, None))
+        return scen_idx, results
+
+
+def _init_contingency_worker(base_net, outages, warm_start):
+    global _worker_runner
+    _worker_runner = AcContingencyRunner(base_net, outages, warm_start)
+
+
+def iter_load_scenarios(base_net, n_l_scenarios, set_id, seed, chunk_size=None, n_workers=1, warm_start='base', first=0,
+                        sampler=None, n_design=None, retry=None):
+    #Yields the AC scenarios first..n_l_scenarios-1 in chunks of chunk_size scenario indices (all at once if None), each as a ScenarioStore of
+    #the converged scenarios (base scenario 0 included) with the (id, error) of the failed ones in store.failed.
+    #Failed scenarios keep their index, i.e. their id is simply missing. The worker pool is shared by all chunks.
+    #The load factors of each chunk are drawn by sampler (a LoadSampler or its params, uniform if None) and sent to the
+    #workers with the scenario indices; joint designs are drawn for n_design scenarios (n_l_scenarios if None).
+    #Scenarios that fail go through the fallback chain of retry (see RetryPolicy, default chain if None, no retries if
+    #False): a scenario with resampled loads keeps its index and id, so only a used up budget leaves gaps. Rejected
+    #attempts of converged and failed scenarios are counted in metrics (ac_rejected:<stage>, ac_resamples) and the attempts
+    #per converged scenario are kept in store.attempts.
+    chunk_size = chunk_size or n_l_scenarios
+    sampler = LoadSampler.from_params(sampler)
+    retry = RetryPolicy.from_params(retry)
+    budget = None
+    if retry is not None: #one budget for the scenarios of this call, shared by the workers
+        run_max_resamples = retry.run_max_resamples
+        if run_max_resamples is None:
+            run_max_resamples = RESAMPLES_PER_SCENARIO*(n_l_scenarios - max(first, 1))
+        budget = RunBudget(run_max_resamples, retry.run_time_budget)
+    runner_args = (warm_start, retry or False, sampler, seed, set_id, budget)
+    with contextlib.ExitStack() as stack:
+        if n_workers > 1 and n_l_scenarios - first > 2:
+            logger.info('Running Power Flow Analysis for %d scenarios on %d workers..', n_l_scenarios - first, n_workers)
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=n_workers, initializer=_init_scen_worker,
+                                                               initargs=(base_net,) + runner_args))
+        else:
+            executor = None
+            runner = _init_scen_worker(base_net, *runner_args)
+
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for start in range(first, n_l_scenarios, chunk_size):
+            with metrics.stage('ac_scenarios'): #per chunk, so the time spent by the consumer of the chunks is not counted
+                scen_indices = range(start, min(start + chunk_size, n_l_scenarios))
+                store = ScenarioStore(base_net, len(scen_indices))
+                factor = sampler.sample(seed, set_id, n_design or n_l_scenarios, len(base_net.load), scen_indices)
+                tasks = [(i, factor[row]) for row, i in enumerate(scen_indices) if i > 0]
+                if start == 0: #scenario 0 is the base scenario
+                    store.put(0, set_id + str(0), net2result(base_net, np.ones(len(base_net.load)), compile_meas_map(base_net)))
+
+                if executor is not None:
+                    chunksize = max(1, len(tasks) // (4 * n_workers))
+                    results = executor.map(_run_load_scenario_in_worker, tasks, chunksize=chunksize)
+                else:
+                    results = (runner.run(i, scen_factor) for i, scen_factor in tasks)
+                for scen_idx, result, err, tried in results: #results are in scenario order for any number of workers
+                    scen_id = set_id + str(scen_idx)
+                    for stage in tried['rejected']:
+                        metrics.count('ac_rejected:' + stage)
+                    if tried['resamples']:
+                        metrics.count('ac_resamples', tried['resamples'])
+                    if result is None:
+                        store.failed.append((scen_id, err))
+                        metrics.count('ac_scenarios_failed')
+                        metrics.scenario(scen_id, error=err, attempts=len(tried['rejected']))
+                        logger.debug('Power Flow Analysis for net %3d failed: %s', scen_idx, err)
+                    else:
+                        store.put(scen_idx - start, scen_id, result)
+                        metrics.count('ac_scenarios_solved')
+                        metrics.count('nr_iterations', result['iterations'])
+                        metrics.count('pf_time_s', result['pf_time'])
+                        if result['attempts'] > 1:
+                            metrics.count('ac_scenarios_retried')
+                        metrics.scenario(scen_id, result['iterations'], result['pf_time'], attempts=result['attempts'])
+                        if debug:
+                            logger.debug('Power Flow Analysis for net %3d: %d NR iterations, %.4f s', scen_idx,
+                                         result['iterations'], result['pf_time'])
+            yield store.compact()
+
+
+def run_load_scenarios(base_net, n_l_scenarios, set_id, n_workers=1, seed=None, warm_start='base', sampler=None, retry=None):
+    #Returns a ScenarioStore of converged scenarios (base scenario 0 included) plus a list of (id, error) of failed ones.
+    #NR iterations and power flow time per scenario are kept in store.iterations and store.pf_time.
+    seed = run_seed(seed, 'run_load_scenarios')
+    store = concat_stores(list(iter_load_scenarios(base_net, n_l_scenarios, set_id, seed, n_workers=n_workers, warm_start=warm_start,
+                                                     sampler=sampler, retry=retry)))
+    _log_run_summary(store, n_l_scenarios)
+    return store, store.failed
+
+def _log_run_summary(store, n_l_scenarios, first=0):
+    if store.failed:
+        logger.warning('%d of %d scenarios failed and are NOT counted: %s', len(store.failed), n_l_scenarios - max(first, 1),
+                       ', '.join(scen_id for scen_id, _ in store.failed))
+    converged = store.iterations[store.iterations >= 0]
+    if len(converged):
+        logger.info('NR iterations per scenario: mean %.2f, max %d', converged.mean(), converged.max())
+    retried = store.attempts[store.attempts > 1]
+    if len(retried):
+        logger.info('%d scenarios converged only after a fallback (up to %d attempts)', len(retried), retried.max())
+
+
+def _bus_incidence(net, element):
+    #(n_elements x n_buses) sparse incidence of in-service elements of a bus-connected table, weighted by their scaling
+    weight = (net[element]['scaling']*net[element]['in_service']).values.astype(float)
+    bus_pos = net.bus.index.get_indexer(net[element]['bus'].values)
+    return sp.csr_matrix((weight, (np.arange(len(weight)), bus_pos)), shape=(len(weight), len(net.bus)))
+
+
+def _h4all_branch(net, h4all, element_type, element):
+    #Position of the from->to flow row of a line or trafo in h4all, its susceptance and its from/to bus positions
+    if element_type == 'line':
+        row = 2*net.line.index.get_loc(element)
+        from_bus, to_bus = net.line.at[element, 'from_bus'], net.line.at[element, 'to_bus']
+    elif element_type == 'trafo':
+        row = 2*(len(net.line) + net.trafo.index.get_loc(element))
+        from_bus, to_bus = net.trafo.at[element, 'lv_bus'], net.trafo.at[element, 'hv_bus'] #as in gen_h4all
+    else:
+        raise ValueError("Outages are supported for 'line' and 'trafo' only, got {!r}".format(element_type))
+    from_pos, to_pos = net.bus.index.get_indexer([from_bus, to_bus])
+    return row, h4all.matrix[row, from_pos], from_pos, to_pos
+
+
+def _check_dc_model(net, h4all, b_bus, non_slack):
+    #Raises ValueError naming the branches without a finite nonzero susceptance and the buses left without any branch,
+    #instead of the bare 'Factor is exactly singular' of splu
+    n_branch_rows = 2*(len(net.line) + len(net.trafo))
+    flows = h4all.matrix[:n_branch_rows]
+    b = np.zeros(n_branch_rows)
+    finite = np.ones(n_branch_rows, dtype=bool)
+    for row in range(n_branch_rows):
+        data = flows.data[flows.indptr[row]:flows.indptr[row + 1]]
+        b[row] = np.abs(data).sum()
+        finite[row] = np.isfinite(data).all()
+    bad = np.flatnonzero(~finite[::2] | (b[::2] == 0))
+    if len(bad):
+        raise ValueError('DC model: branches {} have no finite nonzero susceptance (check x_ohm_per_km, vk_percent)'.format(
+            ', '.join(h4all.labels[2*bad][:10])))
+    isolated = non_slack[b_bus[non_slack][:, non_slack].diagonal() == 0]
+    if len(isolated):
+        raise ValueError('DC model: buses {} are not connected by any branch'.format(
+            ', '.join(str(bus) for bus in net.bus.index[isolated][:10])))
+
+
+class DcModel:
+    #DC model of the base net built from h4all: the reduced bus susceptance matrix (same susceptances as h4all, hence
+    #consistent with h/h_no_slack) is factorized once and the angles of a whole batch of scenarios are found in one
+    #multi-rhs solve. Flows and injections are then H @ theta. Single branch outages are rank-one updates of the same
+    #factorization (Sherman-Morrison), see solve_outage.
+
+    def __init__(self, base_net, h4all=None):
+        if h4all is None:
+            h4all = gen_h4all(base_net)
+        if isinstance(h4all, pd.DataFrame):
+            h4all = SparseH(h4all.values, h4all.index, h4all.columns)
+        self.net = base_net
+        self.h4all = h4all
+        self.n_buses = len(base_net.bus)
+        self.p_rows = h4all.positions(['p'+str(bus_id) for bus_id in base_net.bus.index])
+        b_bus = -h4all.matrix[self.p_rows] #injection rows of H are the negated bus susceptance matrix
+
+        self.slack_pos, first_ext_grid = np.unique(base_net.bus.index.get_indexer(base_net.ext_grid['bus'].values), return_index=True)
+        self.slack_va = np.deg2rad(base_net.ext_grid['va_degree'].values[first_ext_grid].astype(float))
+        self.non_slack = np.setdiff1d(np.arange(self.n_buses), self.slack_pos)
+        _check_dc_model(base_net, h4all, b_bus, self.non_slack)
+        self.b_slack = b_bus[self.non_slack][:, self.slack_pos] @ self.slack_va
+        self.lu = splu(b_bus[self.non_slack][:, self.non_slack].tocsc())
+
+        #Injections (generator convention, MW) = generation - scaled loads, aggregated per bus
+        self.p_gen = np.zeros(self.n_buses)
+        for element in ['gen', 'sgen']:
+            if len(base_net[element]):
+                self.p_gen += _bus_incidence(base_net, element).T @ base_net[element]['p_mw'].values
+        self.load2bus = _bus_incidence(base_net, 'load').T.tocsr()
+        self.base_load_p = base_net.load['p_mw'].values
+
+        self.meas_map = compile_meas_map(base_net)
+        self.base_meas_value = base_net.measurement['value'].values
+        n_lines = len(base_net.line)
+        self.line_rows = np.arange(n_lines)
+        self.trafo_rows = n_lines + np.arange(len(base_net.trafo))
+
+    def injections(self, factor):
+        #(n_buses x batch) active power injections in per unit for a batch of load factors
+        return (self.p_gen[:, np.newaxis] - self.load2bus @ (factor*self.base_load_p).T)/self.net.sn_mva
+
+    def solve(self, p_inj):
+        theta = np.empty((self.n_buses, p_inj.shape[1]))
+        theta[self.slack_pos] = self.slack_va[:, np.newaxis]
+        theta[self.non_slack] = self.lu.solve(p_inj[self.non_slack] - self.b_slack[:, np.newaxis])
+        return theta
+
+    def branch(self, element_type, element):
+        return _h4all_branch(self.net, self.h4all, element_type, element)
+
+    def solve_outage(self, theta, element_type, element):
+        #Angles with one branch out of service from the intact angles theta (n_buses x batch). Removing the branch changes
+        #the bus susceptance matrix by -b a a^T (a = e_from - e_to), so the reduced system is solved by Sherman-Morrison with
+        #a single extra solve. Returns None if the outage islands the grid.
+        _, b, from_pos, to_pos = self.branch(element_type, element)
+        a = np.zeros(self.n_buses)
+        a[from_pos], a[to_pos] = 1, -1
+        a_red = a[self.non_slack]
+        z = self.lu.solve(a_red)
+        denominator = 1 - b*(a_red @ z)
+        if abs(denominator) < 1e-9:
+            return None
+        #the slack columns of the matrix change as well when the branch ends at the slack bus
+        theta_red = theta[self.non_slack] + b*z[:, np.newaxis]*(a[self.slack_pos] @ self.slack_va)
+        theta_out = theta.copy()
+        theta_out[self.non_slack] = theta_red + z[:, np.newaxis]*(b*(a_red @ theta_red)/denominator)
+        return theta_out
+
+    def results(self, factor, theta, outage=None):
+        #Result arrays and measurement values of a batch (H of the outage case if outage=(element_type, element))
+        sn_mva = self.net.sn_mva
+        flows = (self.h4all.matrix @ theta).T*sn_mva #(batch x rows of h4all), MW with the sign conventions of pandapower results
+        if outage is not None: #no flow on the outaged branch, its susceptance removed from the injections
+            row, b, from_pos, to_pos = self.branch(*outage)
+            flows[:, [row, row + 1]] = 0
+            branch_flow = b*(theta[from_pos] - theta[to_pos])*sn_mva
+            flows[:, self.p_rows[from_pos]] += branch_flow
+            flows[:, self.p_rows[to_pos]] -= branch_flow
+        batch = len(factor)
+        res = {('res_bus', 'vm_pu'): np.ones((batch, self.n_buses)),
+               ('res_bus', 'va_degree'): np.rad2deg(theta.T),
+               ('res_bus', 'p_mw'): flows[:, self.p_rows],
+               ('res_line', 'p_from_mw'): flows[:, 2*self.line_rows],
+               ('res_line', 'p_to_mw'): flows[:, 2*self.line_rows + 1],
+               ('res_trafo', 'p_lv_mw'): flows[:, 2*self.trafo_rows], #lv side is the from side of trafo rows in h4all
+               ('res_trafo', 'p_hv_mw'): flows[:, 2*self.trafo_rows + 1]}
+        for (table, column) in [(table, column) for table, columns in RES_COLUMNS.items() for column in columns]:
+            if (table, column) not in res: #no reactive power in the DC model
+                res[(table, column)] = np.zeros((batch, len(self.net[table])))
+        meas_value = gather_meas(self.meas_map, res, np.tile(self.base_meas_value, (batch, 1)))
+        return res, meas_value
+
+
+def iter_dc_scenarios(base_net, n_l_scenarios, set_id, seed, chunk_size=1000, h4all=None, first=0, sampler=None,
+                      n_design=None):
+    #DC model of all load scenarios (see DcModel). Load factors are the same as in the AC runner (same seeds and sampler).
+    #Yields one ScenarioStore per chunk of scenarios first..n_l_scenarios-1.
+    chunk_size = chunk_size or n_l_scenarios
+    sampler = LoadSampler.from_params(sampler)
+    model = DcModel(base_net, h4all)
+    logger.info('Running DC Power Flow Analysis for %d scenarios..', n_l_scenarios - first)
+    for start in range(first, n_l_scenarios, chunk_size):
+        with metrics.stage('dc_scenarios'):
+            scen_idx = np.arange(start, min(start + chunk_size, n_l_scenarios))
+            store = ScenarioStore(base_net, len(scen_idx))
+            factor = sampler.sample(seed, set_id, n_design or n_l_scenarios, len(base_net.load), scen_idx)
+            res, meas_value = model.results(factor, model.solve(model.injections(factor)))
+            store.put_batch(np.arange(len(scen_idx)), [set_id + str(i) for i in scen_idx], factor, res, meas_value)
+            metrics.count('dc_scenarios_solved', len(scen_idx))
+        yield store
+
+
+def run_dc_scenarios(base_net, n_l_scenarios, set_id, seed=None, h4all=None, chunk_size=1000, sampler=None):
+    seed = run_seed(seed, 'run_dc_scenarios')
+    return concat_stores(list(iter_dc_scenarios(base_net, n_l_scenarios, set_id, seed, chunk_size, h4all, sampler=sampler)))
+
+
+def iter_contingency_scenarios(base_net, n_l_scenarios, set_id, seed, outages=None, chunk_size=None, mode='dc', n_workers=1,
+                               warm_start='base', include_intact=True, h4all=None, first=0, sampler=None):
+    #N-1 contingency scenarios: every load scenario first..n_l_scenarios-1 (same loads as the clean scenarios) with each
+    #branch of outages out of service (all in-service lines and trafos by default), preceded by the intact case if
+    #include_intact. DC outages are rank-one updates of the intact factorization (DcModel.solve_outage), AC outages are
+    #started from the intact solution (AcContingencyRunner). Scenario ids are set_id+index for the intact case and
+    #set_id+index+'_'+label for outages (e.g. A7_line3); store.outage holds the label.
+    #Yields one ScenarioStore per chunk of load scenarios, failed (e.g. islanding) cases in store.failed.
+    outages = branch_outages(base_net) if outages is None else [tuple(outage) for outage in outages]
+    sampler = LoadSampler.from_params(sampler)
+    cases = ([None] if include_intact else []) + outages
+    chunk_size = chunk_size or n_l_scenarios
+    scen_ids = lambda i: [set_id + str(i) + ('_' + outage_label(case) if case else '') for case in cases]
+    logger.info('Running %s contingency analysis for %d load scenarios x %d outages..', mode.upper(), n_l_scenarios - first,
+                len(outages))
+    with contextlib.ExitStack() as stack:
+        if mode == 'dc':
+            model = DcModel(base_net, h4all)
+        elif mode != 'ac':
+            raise ValueError("mode shall be either 'ac' or 'dc', got {!r}".format(mode))
+        elif n_workers > 1 and n_l_scenarios - first > 2:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=n_workers, initializer=_init_contingency_worker,
+                                                               initargs=(base_net, outages, warm_start)))
+        else:
+            executor = None
+            runner = AcContingencyRunner(base_net, outages, warm_start)
+
+        for start in range(first, n_l_scenarios, chunk_size):
+            with metrics.stage('contingency_scenarios'):
+                scen_idx = np.arange(start, min(start + chunk_size, n_l_scenarios))
+                store = ScenarioStore(base_net, len(scen_idx)*len(cases))
+                factor = sampler.sample(seed, set_id, n_l_scenarios, len(base_net.load), scen_idx)
+                if mode == 'dc':
+                    theta = model.solve(model.injections(factor))
+                    ids = np.array([scen_ids(i) for i in scen_idx], dtype=object)
+                    for k, case in enumerate(cases):
+                        case_theta = theta if case is None else model.solve_outage(theta, *case)
+                        if case_theta is None:
+                            store.failed.extend((scen_id, 'outage islands the grid') for scen_id in ids[:, k])
+                            continue
+                        res, meas_value = model.results(factor, case_theta, case)
+                        store.put_batch(np.arange(len(scen_idx))*len(cases) + k, ids[:, k], factor, res, meas_value,
+                                        outage_label(case))
+                else:
+                    tasks = list(zip(scen_idx, factor))
+                    if executor is not None:
+                        results = executor.map(_run_load_scenario_in_worker, tasks,
+                                               chunksize=max(1, len(tasks) // (4 * n_workers)))
+                    else:
+                        results = (runner.run(i, scen_factor) for i, scen_factor in tasks)
+                    for i, case_results in results:
+                        if not include_intact:
+                            case_results = case_results[1:]
+                        for k, (scen_id, (label, result, err)) in enumerate(zip(scen_ids(i), case_results)):
+                            if result is None:
+                                store.failed.append((scen_id, err))
+                            else:
+                                result['outage'] = label
+                                store.put((i - start)*len(cases) + k, scen_id, result)
+                metrics.count('contingency_scenarios_solved', int(store.filled.sum()))
+                metrics.count('contingency_scenarios_failed', len(store.failed))
+            yield store.compact()
+
+
+def gen_contingency_scenarios(base_net, n_l_scenarios, set_id, outages=None, mode='dc', n_workers=1, seed=None,
+                              warm_start='base', include_intact=True, h4all=None, sampler=None):
+    #Returns ids and a ScenarioStore of the N-1 contingency scenarios (see iter_contingency_scenarios). Use
+    #outages2features for the outage labels and gen_outage_h/meas_h for the H of an outage case.
+    seed = run_seed(seed, 'gen_contingency_scenarios')
+    store = concat_stores(list(iter_contingency_scenarios(base_net, n_l_scenarios, set_id, seed, outages, mode=mode,
+                                                          n_workers=n_workers, warm_start=warm_start,
+                                                          include_intact=include_intact, h4all=h4all, sampler=sampler)))
+    if store.failed:
+        logger.warning('%d contingency scenarios failed and are NOT counted (e.g. %s: %s)', len(store.failed), *store.failed[0])
+    return list(store.ids), store
+
+
+def iter_clean_scenarios(base_net, n_l_scenarios, set_id, seed, chunk_size=None, mode='ac', n_workers=1, warm_start='base',
+                         first=0, sampler=None, n_design=None, retry=None):
+    #Clean scenarios first..n_l_scenarios-1 in chunks of chunk_size scenario indices, either AC (iter_load_scenarios) or
+    #DC (iter_dc_scenarios, which always converges, retry is ignored)
+    if mode == 'dc':
+        return iter_dc_scenarios(base_net, n_l_scenarios, set_id, seed, chunk_size, first=first, sampler=sampler,
+                                 n_design=n_design)
+    elif mode == 'ac':
+        return iter_load_scenarios(base_net, n_l_scenarios, set_id, seed, chunk_size, n_workers, warm_start, first,
+                                   sampler, n_design, retry)
+    raise ValueError("mode shall be either 'ac' or 'dc', got {!r}".format(mode))
+
+
+def run_checkpointed(base_net, n_l_scenarios, set_id, checkpoint_path, seed=None, checkpoint_every=100, mode='ac',
+                     n_workers=1, warm_start='base', resume=True, first=0, sampler=None, n_design=None, retry=None):
+    #Runs the clean scenarios in chunks of checkpoint_every and saves each completed chunk (results and failures) to
+    #checkpoint_path, together with run.json holding the seed and the next scenario index (the RNG state, since every
+    #scenario is seeded from seed, set_id and its index). With resume, completed chunks of an earlier run of the same
+    #set_id are loaded and only the remaining scenarios are computed; asking for more scenarios than an earlier run
+    #extends it. Scenario ids are therefore the same whatever the number of resumes. first starts the run (a shard) at
+    #scenario first instead of 0. The load sampler (uniform if None) is saved to run.json as well and a resumed run keeps
+    #it; runs with a joint design (LHS, Sobol) of n_design scenarios cannot be extended beyond it.
+    n_design = n_design or n_l_scenarios
+    os.makedirs(checkpoint_path, exist_ok=True)
+    run_file = os.path.join(checkpoint_path, 'run.json')
+    stores = []
+    if resume and os.path.exists(run_file):
+        with open(run_file) as f:
+            run = json.load(f)
+        if run['set_id'] != set_id or run['mode'] != mode or run['first'] != first:
+            raise ValueError('Checkpoint in {} belongs to set_id {!r} ({}, from scenario {}), not {!r} ({}, from scenario {})'.format(
+                checkpoint_path, run['set_id'], run['mode'], run['first'], set_id, mode, first))
+        if seed is not None and seed != run['seed']:
+            raise ValueError('Checkpoint in {} was generated with seed {}, not {}'.format(checkpoint_path, run['seed'], seed))
+        seed = run['seed']
+        run_sampler = LoadSampler.from_params(run['load_sampler'])
+        if sampler is not None and LoadSampler.from_params(sampler).params() != run_sampler.params():
+            raise ValueError('Checkpoint in {} was generated with {}, not {}'.format(checkpoint_path, run_sampler,
+                                                                                     LoadSampler.from_params(sampler)))
+        sampler = run_sampler
+        if sampler.kind in JOINT_KINDS and n_design != run['n_design']:
+            raise ValueError('Checkpoint in {} holds a {} design of {} scenarios, it cannot be extended to {}'.format(
+                checkpoint_path, sampler.kind, run['n_design'], n_design))
+        run['n_design'] = n_design
+        stores = [load_store(os.path.join(checkpoint_path, chunk_file)) for chunk_file in run['chunks']]
+        for store in stores:
+            if list(store.meas_names) != list(base_net.measurement['name']) or store.load_factor.shape[1] != len(base_net.load):
+                raise ValueError('Checkpoint in {} does not match the measurements or loads of base_net'.format(checkpoint_path))
+        logger.info('run_checkpointed: Resuming %s from scenario %d (%d chunks loaded)', set_id, run['next_scenario'], len(stores))
+    else:
+        seed = run_seed(seed, 'run_checkpointed')
+        sampler = LoadSampler.from_params(sampler)
+        run = {'set_id': set_id, 'mode': mode, 'seed': int(seed), 'first': first, 'next_scenario': first, 'chunks': [],
+               'load_sampler': sampler.params(), 'n_design': n_design}
+
+    for store in iter_clean_scenarios(base_net, n_l_scenarios, set_id, run['seed'], checkpoint_every, mode, n_workers,
+                                      warm_start, first=run['next_scenario'], sampler=sampler, n_design=n_design,
+                                      retry=retry):
+        stop = min(run['next_scenario'] + checkpoint_every, n_l_scenarios)
+        chunk_file = 'chunk-{:08d}-{:08d}.npz'.format(run['next_scenario'], stop)
+        with metrics.stage('checkpoint'):
+            save_store(store, os.path.join(checkpoint_path, chunk_file))
+            run['chunks'].append(chunk_file)
+            run['next_scenario'] = stop
+            _write_json_atomic(run, run_file) #chunk file first, so run.json never points to a missing chunk
+        stores.append(store)
+        logger.info('run_checkpointed: Checkpoint saved, %d of %d scenarios done', stop, n_l_scenarios)
+    return concat_stores(stores)
+
+def _write_json_atomic(data, path):
+    with replacing(path) as tmp, open(tmp, 'w') as f:
+        json.dump(data, f, indent=1)
+
+
+def extend_scenarios(base_net, n_more, checkpoint_path, **kwargs):
+    #Adds n_more scenarios to the run checkpointed in checkpoint_path without recomputing the existing ones (same seed and
+    #load sampler, see run_checkpointed). Returns ids and store of all scenarios of the run, as gen_clean_scen_unfrm
+    with open(os.path.join(checkpoint_path, 'run.json')) as f:
+        run = json.load(f)
+    store = run_checkpointed(base_net, run['next_scenario'] + n_more, run['set_id'], checkpoint_path, mode=run['mode'],
+                             resume=True, first=run['first'], **kwargs)
+    return list(store.ids), store
+
+
+def gen_clean_scen_unfrm(base_net, n_l_scenarios,set_id, n_workers=1, seed=None, mode='ac', warm_start='base',
+                         checkpoint_path=None, checkpoint_every=100, shard=None, scen_range=None, sampler=None, retry=None):
+    #Returns ids and a ScenarioStore (array-backed) of the clean scenarios instead of a list of nets.
+    #mode='dc' solves all scenarios with the DC model of h4all (see run_dc_scenarios) instead of AC pp.runpp.
+    #warm_start applies to AC scenarios only (see AcScenarioRunner). With checkpoint_path (e.g. trial_path+'checkpoints'),
+    #completed scenarios are saved every checkpoint_every scenarios and an interrupted run resumes from there (see run_checkpointed)
+    #shard=(k, N) or scen_range=(first, stop) only computes that part of the n_l_scenarios (see shard_range); all shards
+    #need the same seed. sampler draws the load factors (a LoadSampler, its params or a kind name, see load_sampling),
+    #uniform in [0.1, 1.1) if None. AC scenarios that do not converge are retried with new loads until they converge or
+    #the run budget is used up (see RetryPolicy; retry=False reports them as failed at once).
+    first, stop = shard_range(n_l_scenarios, shard, scen_range)
+    if (first, stop) == (0, n_l_scenarios):
+        logger.info('gen_clean_scen_unfrm: Generating BASE CLEAN scenario 0 and %d load scenarios (%s)... ', n_l_scenarios - 1, mode)
+    else:
+        logger.info('gen_clean_scen_unfrm: Generating scenarios %d..%d of %d (%s)... ', first, stop - 1, n_l_scenarios, mode)
+    if checkpoint_path is not None:
+        if shard is not None or scen_range is not None:
+            seed = _shard_seed(seed, shard, scen_range, 'gen_clean_scen_unfrm')
+        store = run_checkpointed(base_net, stop, set_id, checkpoint_path, seed=seed, checkpoint_every=checkpoint_every,
+                                 mode=mode, n_workers=n_workers, warm_start=warm_start, first=first, sampler=sampler,
+                                 n_design=n_l_scenarios, retry=retry)
+        _log_run_summary(store, stop, first)
+        return list(store.ids), store
+    seed = _shard_seed(seed, shard, scen_range, 'gen_clean_scen_unfrm')
+    store = concat_stores(list(iter_clean_scenarios(base_net, stop, set_id, seed, mode=mode, n_workers=n_workers,
+                                                    warm_start=warm_start, first=first, sampler=sampler,
+                                                    n_design=n_l_scenarios, retry=retry)) or [ScenarioStore(base_net, 0)])
+    _log_run_summary(store, stop, first)
+    return  list(store.ids),store
+
+@metrics.timed('duplicate_scenarios')
 def duplicate_scenarios(nets_ids,nets, rpt_per_elmnt):
-    print('\n')
-    print('Duplicating each input (usually clean) scenario {} times...'.format(str(rpt_per_elmnt)))
+    logger.info('Duplicating each input (usually clean) scenario %d times...', rpt_per_elmnt)
+    if isinstance(nets, ScenarioStore):
+        new_ids=list(np.repeat(np.asarray(nets_ids, dtype=object), rpt_per_elmnt))
+        return new_ids, nets.take(np.repeat(np.arange(len(nets)), rpt_per_elmnt))
     new_list=[]
     new_ids=[]
     for i in range(len(nets)):
@@ -366,103 +1037,130 @@ def duplicate_scenarios(nets_ids,nets, rpt_per_elmnt):
 
 
 
-def meas2features(nets_ids,nets ): #nets and nets_ids are both lists
-    print('Convert measurements to features..')
-    features = nets[0].measurement['name']
-    examples = []
-    for _,net in enumerate(nets):
-        example = net.measurement['value'].values
-        examples.append(example)
+@metrics.timed('meas2features')
+def meas2features(nets_ids,nets ): #nets_ids is a list, nets either a list of nets or a ScenarioStore
+    logger.info('Convert measurements to features..')
+    if isinstance(nets, ScenarioStore):
+        features = nets.meas_names
+        examples = nets.meas_value
+    else:
+        features = nets[0].measurement['name'].to_list()
+        examples = []
+        for _,net in enumerate(nets):
+            example = net.measurement['value'].values
+            examples.append(example)
     data_id=pd.DataFrame(nets_ids, columns=['l_scenario_id'])
-    data_values=pd.DataFrame(examples, columns=[*features.to_list()])
+    data_values=pd.DataFrame(examples, columns=[*features])
     data=pd.concat([data_id,data_values ],axis=1)
-    print('Done!')
+    logger.info('Done!')
     return data
 
-def pf_states2features(nets_ids, nets):
-    print('Convert estimated states to features..')
-    examples=[]
-    indices = nets[0].res_bus.index
+
+def _state_features(indices, prefixes):
     indices = np.char.array(indices)
-    vm_features = np.chararray(len(indices), itemsize=3)
-    vm_features[:] = 'vm_'
-    vm_features = vm_features + indices
-    va_features = np.chararray(len(indices), itemsize=3)
-    va_features[:] = 'va_'
-    va_features = va_features + indices
-    features =np.concatenate([vm_features,va_features])
-    for _, net in enumerate(nets):
-        #try:
-        example=np.concatenate([net.res_bus['vm_pu'], net.res_bus['va_degree']*np.pi/180]) #convert angle into radians
-        examples.append(example)
-        #except:
-            #pass
+    features = []
+    for prefix in prefixes:
+        prefix_features = np.chararray(len(indices), itemsize=3)
+        prefix_features[:] = prefix
+        features.append(prefix_features + indices)
+    return np.concatenate(features)
+
+@metrics.timed('pf_states2features')
+def pf_states2features(nets_ids, nets):
+    logger.info('Convert estimated states to features..')
+    if isinstance(nets, ScenarioStore):
+        features = _state_features(nets.bus_index, ['vm_', 'va_'])
+        examples = np.concatenate([nets.vm_pu, nets.va_degree*np.pi/180], axis=1) #convert angle into radians
+    else:
+        features = _state_features(nets[0].res_bus.index, ['vm_', 'va_'])
+        examples=[]
+        for _, net in enumerate(nets):
+            example=np.concatenate([net.res_bus['vm_pu'], net.res_bus['va_degree']*np.pi/180]) #convert angle into radians
+            examples.append(example)
     data_id=pd.DataFrame(nets_ids, columns=['l_scenario_id'])
     data_values=pd.DataFrame(examples, columns=features.astype('U13'))
     data=pd.concat([data_id,data_values ],axis=1)
-    print('Done!')
+    logger.info('Done!')
     return data
 
 
-
-#####################################################
-
-def pf_states2features(nets_ids, nets):
-    print('Convert estimated states to features..')
-    examples=[]
-    indices = nets[0].res_bus.index
-    indices = np.char.array(indices)
-    vm_features = np.chararray(len(indices), itemsize=3)
-    vm_features[:] = 'vm_'
-    vm_features = vm_features + indices
-    va_features = np.chararray(len(indices), itemsize=3)
-    va_features[:] = 'va_'
-    va_features = va_features + indices
-    features =np.concatenate([vm_features,va_features])
-    for _, net in enumerate(nets):
-        #try:
-        example=np.concatenate([net.res_bus['vm_pu'], net.res_bus['va_degree']*np.pi/180]) #convert angle into radians
-        examples.append(example)
-        #except:
-            #pass
+@metrics.timed('pfdc_states2features')
+def pfdc_states2features(nets_ids, nets):
+    logger.info('Convert estimated states to features..')
+    if isinstance(nets, ScenarioStore):
+        features = _state_features(nets.bus_index, ['va_'])
+        examples = nets.va_degree*np.pi/180 #convert angle into radians
+    else:
+        features = _state_features(nets[0].res_bus.index, ['va_'])
+        examples=[]
+        for _, net in enumerate(nets):
+            example=np.concatenate([net.res_bus['va_degree']*np.pi/180]) #convert angle into radians
+            examples.append(example)
     data_id=pd.DataFrame(nets_ids, columns=['l_scenario_id'])
     data_values=pd.DataFrame(examples, columns=features.astype('U13'))
     data=pd.concat([data_id,data_values ],axis=1)
-    print('Done!')
+    logger.info('Done!')
     return data
 
 
-def pfdc_states2features(nets_ids, nets):
-    print('Convert estimated states to features..')
-    examples=[]
-    indices = nets[0].res_bus.index
-    indices = np.char.array(indices)
-    va_features = np.chararray(len(indices), itemsize=3)
-    va_features[:] = 'va_'
-    va_features = va_features + indices
-    features =np.concatenate([va_features])
-    for _, net in enumerate(nets):
-        #try:
-        example=np.concatenate([net.res_bus['va_degree']*np.pi/180]) #convert angle into radians
-        examples.append(example)
-        #except:
-            #pass
-    data_id=pd.DataFrame(nets_ids, columns=['l_scenario_id'])
-    data_values=pd.DataFrame(examples, columns=features.astype('U13'))
-    data=pd.concat([data_id,data_values ],axis=1)
-    print('Done!')
+def outages2features(nets_ids, nets):
+    #Outage labels of contingency scenarios (ScenarioStore) as numeric features: index of the line/trafo out of service,
+    #-1 if none (intact case)
+    data = pd.DataFrame({'l_scenario_id': nets_ids})
+    for element_type in ['line', 'trafo']:
+        data['outage_' + element_type] = [int(label[len(element_type):]) if label.startswith(element_type) else -1
+                                          for label in nets.outage]
     return data
 
 
+def load_factors2features(nets_ids, nets, load_index):
+    #Load factors of the scenarios (ScenarioStore), one column lf_<load index> per load
+    data_id = pd.DataFrame(nets_ids, columns=['l_scenario_id'])
+    data_values = pd.DataFrame(nets.load_factor, columns=_state_features(load_index, ['lf_']).astype('U13'))
+    return pd.concat([data_id, data_values], axis=1)
+
+
 
 #######################################################3
 
 
 #Generating Noise
-def gen_noisy_meas(run_hp,ids,scenarios):
-    print('\n')
+def gen_noisy_meas_batch(clean_meas, std_dev, noise_per_clean, noise_on_meas='gaussian', seed=None):
+    #clean_meas: (scenarios x measurements), std_dev: (measurements,). Returns the (scenarios x noise_per_clean x measurements)
+    #noisy tensor drawn in one call. The inputs are never modified.
+    clean_meas = np.asarray(clean_meas, dtype=float)[:, np.newaxis, :]
+    std_dev = np.asarray(std_dev, dtype=float)
+    size = (clean_meas.shape[0], noise_per_clean, clean_meas.shape[2])
+    return draw_noise(np.random.default_rng(seed), clean_meas, std_dev, size, noise_on_meas)
+
+
+@metrics.timed('gen_noisy_scenarios')
+def gen_noisy_scenarios(run_hp, ids, scenarios, noise_per_clean, seed=None):
+    #Replaces duplicate_scenarios + gen_noisy_meas: returns noise_per_clean noisy copies of each clean scenario of the store
+    #(same ids and row order as duplicate_scenarios). The clean store is left untouched. seed may also be a list of one seed
+    #per clean scenario, so that the noise of a scenario does not depend on the other scenarios of the batch.
+    logger.info('Add noise to measurements (%d noisy scenarios per clean scenario)..', noise_per_clean)
+    if isinstance(seed, list):
+        noisy = np.concatenate([gen_noisy_meas_batch(scenarios.meas_value[row:row + 1], scenarios.meas_std_dev, noise_per_clean,
+                                                     run_hp['noise_on_meas'], scen_seed_seq)
+                                for row, scen_seed_seq in enumerate(seed)]).reshape(len(scenarios), noise_per_clean, -1)
+    else:
+        noisy = gen_noisy_meas_batch(scenarios.meas_value, scenarios.meas_std_dev, noise_per_clean, run_hp['noise_on_meas'], seed)
+    noisy_ids = list(np.repeat(np.asarray(ids, dtype=object), noise_per_clean))
+    noisy_scenarios = scenarios.take(np.repeat(np.arange(len(scenarios)), noise_per_clean))
+    noisy_scenarios.meas_value = noisy.reshape(-1, noisy.shape[2])
+    return noisy_ids, noisy_scenarios
+
+
+@metrics.timed('gen_noisy_meas')
+def gen_noisy_meas(run_hp,ids,scenarios, seed=None):
+    logger.info('Add noise to measurements..')
+    if isinstance(scenarios, ScenarioStore): #returns a noisy copy, the input store keeps its clean values
+        noisy_scenarios = scenarios.take(np.arange(len(scenarios)))
+        noisy_scenarios.meas_value = gen_noisy_meas_batch(scenarios.meas_value, scenarios.meas_std_dev, 1, run_hp['noise_on_meas'], seed)[:, 0, :]
+        return ids, noisy_scenarios
+
     #noisy_scenarios = copy.deepcopy(clean_scenarios)
-    print('Add noise to measurements..')
     for noisy_scen_idx, noisy_scen in enumerate(scenarios):
         # n_meas_per_scenario = len(noisy_scen.measurement)
         meas_values_vec = noisy_scen.measurement['value'].values
@@ -473,13 +1171,153 @@ def gen_noisy_meas(run_hp,ids,scenarios):
         elif run_hp['noise_on_meas']=='uniform':
             noise_scenario_vec = np.random.uniform(low=meas_values_vec-meas_std_dev_vec, high=meas_values_vec+meas_std_dev_vec, size=meas_values_vec.shape[0])
         else:
-            print('Error. Noise imposed on clean scenarios shall be either gaussian or uniform')
+            logger.error('Error. Noise imposed on clean scenarios shall be either gaussian or uniform')
 
 
         # Replace clean measurements values by noisy vector
         noisy_scen.measurement['value'] = noise_scenario_vec
 
-    return ids,scenarios  # These are clean scenarios modified by noise vector
+    return ids,scenarios  # These are clean scenarios modified by noise vector (lists of nets are modified in place)
+
+
+
+
+
+
+
+
+def write_datasets(base_net, run_hp, datasets_path, formats=('parquet',), chunk_size=1000, mode='ac', n_workers=1,
+                   seed=None, noise_seed=None, warm_start='base', write_metrics=True, noisy=True, shard=None, scen_range=None,
+                   sampler=None, retry=None):
+    #Streams the three datasets (source_clean_meas, target_gt_states, source_noisy_meas) to datasets_path chunk by chunk
+    #while the scenarios are generated, so peak memory does not grow with n_clean_scenarios. Rows, ids and columns are
+    #the same as in the notebook (clean rows and states duplicated noise_per_clean times, slack angle dropped).
+    #formats: any of 'parquet', 'hdf5', 'npz', 'csv' (see DatasetWriter). Returns the number of clean scenarios written
+    #and the (id, error) of failed ones. With write_metrics, the run metrics (see instrumentation.RunMetrics) are saved to
+    #datasets_path/metrics.json. With noisy=False, every clean scenario is written once and source_noisy_meas is skipped;
+    #noise is then drawn while training with NoisyBatches (measurement std_dev saved to datasets_path/meas_std_dev.csv).
+    #The noise of each scenario is seeded from noise_seed, set_id and its index (like its loads), so the datasets do not
+    #depend on chunk_size. shard/scen_range only write part of the scenarios (see shard_range); shards written to
+    #separate folders with the same seed and noise_seed are combined by merge_shards. The run parameters (load sampler
+    #included) are saved to datasets_path/shard.json and the load factors of the written scenarios to the load_factors
+    #dataset (one row per clean scenario, see load_factors2features).
+    set_id = run_hp['set_id']
+    n_l_scenarios = run_hp['n_clean_scenarios']
+    first, stop = shard_range(n_l_scenarios, shard, scen_range)
+    seed = _shard_seed(seed, shard, scen_range, 'write_datasets')
+    if noisy:
+        noise_seed = _shard_seed(noise_seed, shard, scen_range, 'write_datasets (noise_seed)')
+    noise_per_clean = run_hp['noise_per_clean']
+    slack_va = ['va_'+str(bus) for bus in base_net.ext_grid['bus'].values]
+    states2features = pfdc_states2features if mode == 'dc' else pf_states2features
+    sampler = LoadSampler.from_params(sampler)
+
+    names = (DATASET_NAMES if noisy else DATASET_NAMES[:2]) + [LOAD_FACTORS]
+    os.makedirs(datasets_path, exist_ok=True)
+    save_std_dev(base_net.measurement['name'].values, base_net.measurement['std_dev'].values,
+                 os.path.join(datasets_path, STD_DEV_FILE))
+    writers = {name: [DatasetWriter(os.path.join(datasets_path, name), fmt) for fmt in formats] for name in names}
+    n_written = 0
+    failed = []
+    try:
+        for store in iter_clean_scenarios(base_net, stop, set_id, seed, chunk_size, mode, n_workers, warm_start, first=first,
+                                          sampler=sampler, n_design=n_l_scenarios, retry=retry):
+            if noisy:
+                noise_seeds = [scen_seed(noise_seed, set_id, int(scen_id[len(set_id):])).spawn(1)[0] #not the stream of the loads
+                               for scen_id in store.ids]
+                dplct_ids, dplct_store = duplicate_scenarios(list(store.ids), store, noise_per_clean)
+                noisy_ids, noisy_store = gen_noisy_scenarios(run_hp, list(store.ids), store, noise_per_clean, seed=noise_seeds)
+            else:
+                dplct_ids, dplct_store = list(store.ids), store
+            chunks = {'source_clean_meas': meas2features(dplct_ids, dplct_store),
+                      'target_gt_states': states2features(dplct_ids, dplct_store).drop(columns=slack_va),
+                      LOAD_FACTORS: load_factors2features(list(store.ids), store, base_net.load.index)}
+            if noisy:
+                chunks['source_noisy_meas'] = meas2features(noisy_ids, noisy_store)
+            with metrics.stage('write_datasets'):
+                for name in names:
+                    for writer in writers[name]:
+                        writer.write(chunks[name])
+                    metrics.count('rows_written:' + name, len(chunks[name]))
+            n_written += len(store)
+            failed.extend(store.failed)
+            logger.info('write_datasets: %d clean scenarios written', n_written)
+    finally:
+        for name in names:
+            for writer in writers[name]:
+                writer.close()
+    _write_json_atomic({'set_id': set_id, 'mode': mode, 'seed': int(seed), 'noise_seed': None if noise_seed is None else int(noise_seed),
+                        'noise_on_meas': run_hp['noise_on_meas'], 'noise_per_clean': noise_per_clean, 'noisy': noisy,
+                        'load_sampler': sampler.params(), 'n_clean_scenarios': n_l_scenarios, 'first': first, 'stop': stop, 'formats': list(formats),
+                        'n_written': n_written, 'failed': [scen_id for scen_id, _ in failed]},
+                       os.path.join(datasets_path, SHARD_FILE))
+    if write_metrics:
+        metrics.write(os.path.join(datasets_path, 'metrics.json'))
+    return n_written, failed
+
+
+@metrics.timed('merge_shards')
+def merge_shards(shard_paths, datasets_path, formats=None):
+    #Concatenates the datasets written by write_datasets for the shards of one run (any order of shard_paths) into
+    #datasets_path, in scenario order, as a single run would have written them. Raises ValueError if the shards belong to
+    #different runs, if scenario ranges overlap or leave gaps, or if an l_scenario_id is missing (and not a failed
+    #scenario), duplicated across shards or out of its shard's range. formats default to those of the shards.
+    shards = []
+    for path in shard_paths:
+        with open(os.path.join(path, SHARD_FILE)) as f:
+            shards.append((json.load(f), path))
+    shards.sort(key=lambda shard: shard[0]['first'])
+    run = shards[0][0]
+    for key in ['set_id', 'mode', 'seed', 'noise_seed', 'noise_on_meas', 'noise_per_clean', 'noisy', 'load_sampler',
+                'n_clean_scenarios']:
+        values = {json.dumps(shard[key]) for shard, _ in shards}
+        if len(values) > 1:
+            raise ValueError('Shards belong to different runs ({} differs: {})'.format(key, ', '.join(sorted(values))))
+    next_scenario = 0
+    for shard, path in shards:
+        if shard['first'] != next_scenario:
+            raise ValueError('Scenarios {}..{} are {} (shard {} starts at {})'.format(
+                min(shard['first'], next_scenario), max(shard['first'], next_scenario) - 1,
+                'missing' if shard['first'] > next_scenario else 'in more than one shard', path, shard['first']))
+        next_scenario = shard['stop']
+    if next_scenario != run['n_clean_scenarios']:
+        raise ValueError('Scenarios {}..{} are missing'.format(next_scenario, run['n_clean_scenarios'] - 1))
+
+    set_id = run['set_id']
+    formats = formats or run['formats']
+    names = (DATASET_NAMES if run['noisy'] else DATASET_NAMES[:2]) + [LOAD_FACTORS]
+    os.makedirs(datasets_path, exist_ok=True)
+    writers = {name: [DatasetWriter(os.path.join(datasets_path, name), fmt) for fmt in formats] for name in names}
+    seen = set()
+    try:
+        for shard, path in shards:
+            expected = {set_id + str(i) for i in range(shard['first'], shard['stop'])} - set(shard['failed'])
+            data = {name: read_dataset(os.path.join(path, name), shard['formats'][0]) for name in names}
+            ids = data['source_clean_meas'][ID_COLUMN].astype(str)
+            for name in names[1:]:
+                name_ids = ids.drop_duplicates() if name == LOAD_FACTORS else ids #one row per clean scenario
+                if not np.array_equal(data[name][ID_COLUMN].astype(str).values, name_ids.values):
+                    raise ValueError('{} of shard {} does not have the rows of source_clean_meas'.format(name, path))
+            present = set(ids)
+            problems = {'missing': expected - present, 'out of range': present - expected, 'duplicated': present & seen}
+            for problem, problem_ids in problems.items():
+                if problem_ids:
+                    raise ValueError('Shard {}: l_scenario_id {} {}'.format(path, ', '.join(sorted(problem_ids)[:10]), problem))
+            seen |= present
+            for name in names:
+                for writer in writers[name]:
+                    writer.write(data[name])
+            logger.info('merge_shards: scenarios %d..%d merged from %s', shard['first'], shard['stop'] - 1, path)
+    finally:
+        for name in names:
+            for writer in writers[name]:
+                writer.close()
+    shutil.copyfile(os.path.join(shards[0][1], STD_DEV_FILE), os.path.join(datasets_path, STD_DEV_FILE))
+    merged = dict(run, first=0, formats=list(formats), n_written=sum(shard['n_written'] for shard, _ in shards),
+                  failed=[scen_id for shard, _ in shards for scen_id in shard['failed']])
+    merged['stop'] = run['n_clean_scenarios']
+    _write_json_atomic(merged, os.path.join(datasets_path, SHARD_FILE))
+    return merged['n_written'], merged['failed']
 
 
 
@@ -490,42 +1328,40 @@ def gen_noisy_meas(run_hp,ids,scenarios):
 
 ###################################################################
 
-def gen_meas_picker(net):
-    # net = self.base_l_scenario
-    m_template = pd.DataFrame()
-
-    for bus_id, row in net.bus.iterrows():
-        m_bus_vm = [False, 'v', 'bus', bus_id, bus_id, bus_id, bus_id]
-        m_bus_p = [False, 'p', 'bus', bus_id, bus_id, bus_id, bus_id]
-        m_bus_q = [False, 'q', 'bus', bus_id, bus_id, bus_id, bus_id]
-
-        m_bus_df = pd.DataFrame([m_bus_vm, m_bus_p, m_bus_q])
-        m_template = m_template.append(m_bus_df)
-
-    for line_id, row in net.line.iterrows():
-        m_line_p_from = [True, 'p', 'line', line_id, 'from', net.line['from_bus'].loc[line_id],net.line['to_bus'].loc[line_id]]
-        m_line_p_to = [True, 'p', 'line', line_id, 'to', net.line['to_bus'].loc[line_id], net.line['from_bus'].loc[line_id]]
-        m_line_q_from = [True, 'q', 'line', line_id, 'from', net.line['from_bus'].loc[line_id],  net.line['to_bus'].loc[line_id]]
-        m_line_q_to = [True, 'q', 'line', line_id, 'to', net.line['to_bus'].loc[line_id], net.line['from_bus'].loc[line_id]]
-        m_line_i_from = [False, 'i', 'line', line_id, 'from', net.line['from_bus'].loc[line_id], net.line['to_bus'].loc[line_id]]
-        m_line_i_to = [False, 'i', 'line', line_id, 'to', net.line['to_bus'].loc[line_id], net.line['from_bus'].loc[line_id]]
-
-        m_line_df = pd.DataFrame(
-            [m_line_p_from, m_line_p_to, m_line_q_from, m_line_q_to, m_line_i_from, m_line_i_to])
-        m_template = m_template.append(m_line_df)
-
-    for trafo_id, row in net.trafo.iterrows():
-        m_trafo_p_hv = [True, 'p', 'trafo', trafo_id, 'hv', net.trafo['hv_bus'].loc[trafo_id], net.trafo['lv_bus'].loc[trafo_id]]
-        m_trafo_p_lv = [True, 'p', 'trafo', trafo_id, 'lv', net.trafo['lv_bus'].loc[trafo_id], net.trafo['hv_bus'].loc[trafo_id]]
-        m_trafo_q_hv = [True, 'q', 'trafo', trafo_id, 'hv', net.trafo['hv_bus'].loc[trafo_id], net.trafo['lv_bus'].loc[trafo_id]]
-        m_trafo_q_lv = [True, 'q', 'trafo', trafo_id, 'lv', net.trafo['lv_bus'].loc[trafo_id], net.trafo['hv_bus'].loc[trafo_id]]
-        m_trafo_i_hv = [False, 'i', 'trafo', trafo_id, 'hv', net.trafo['hv_bus'].loc[trafo_id], net.trafo['lv_bus'].loc[trafo_id]]
-        m_trafo_i_lv = [False, 'i', 'trafo', trafo_id, 'lv', net.trafo['lv_bus'].loc[trafo_id], net.trafo['hv_bus'].loc[trafo_id]]
-
-        m_trafo_df = pd.DataFrame([m_trafo_p_hv, m_trafo_p_lv, m_trafo_q_hv, m_trafo_q_lv, m_trafo_i_hv, m_trafo_i_lv])
-        m_template = m_template.append(m_trafo_df)
-
-    m_template.columns = ['meas_picked', 'meas_type', 'element_type', 'element', 'side', 'side_idx', 'other_side_idx']
-
-    m_template.to_csv('../runs/meas_template.csv', index=False)
-    print('Please go to ../runs/meas_template.csv and select the measurements you need for your study.')
+def _template_block(element_type, elements, specs):
+    #Template rows of one element table built from column arrays: one row per element and spec, rows of an element
+    #consecutive in the order of specs. specs are (meas_picked, meas_type, side, side_idx, other_side_idx), the last three
+    #either scalars or arrays over the elements.
+    n = len(elements)
+    def per_row(pos, dtype):
+        return np.column_stack([np.broadcast_to(np.asarray(spec[pos], dtype=dtype), (n,)) for spec in specs]).ravel()
+    return pd.DataFrame({'meas_picked': np.tile([spec[0] for spec in specs], n),
+                         'meas_type': np.tile([spec[1] for spec in specs], n).astype(object),
+                         'element_type': element_type,
+                         'element': np.repeat(np.asarray(elements), len(specs)),
+                         'side': per_row(2, object),
+                         'side_idx': per_row(3, np.int64),
+                         'other_side_idx': per_row(4, np.int64)})
+
+
+@metrics.timed('gen_meas_picker')
+def gen_meas_picker(net, output_path='../runs/meas_template.csv'):
+    #Measurement template of all bus, line and trafo measurements: bus v/p/q not picked, line and trafo p/q picked and
+    #i not picked. Returns the template and writes it to output_path (unless None) for the measurements to be selected.
+    bus = net.bus.index.values
+    from_bus, to_bus = net.line['from_bus'].values, net.line['to_bus'].values
+    hv_bus, lv_bus = net.trafo['hv_bus'].values, net.trafo['lv_bus'].values
+    m_template = pd.concat([
+        _template_block('bus', bus, [(False, meas_type, bus, bus, bus) for meas_type in ['v', 'p', 'q']]),
+        _template_block('line', net.line.index.values, [
+            (picked, meas_type, side, side_bus, other_bus) for picked, meas_type in [(True, 'p'), (True, 'q'), (False, 'i')]
+            for side, side_bus, other_bus in [('from', from_bus, to_bus), ('to', to_bus, from_bus)]]),
+        _template_block('trafo', net.trafo.index.values, [
+            (picked, meas_type, side, side_bus, other_bus) for picked, meas_type in [(True, 'p'), (True, 'q'), (False, 'i')]
+            for side, side_bus, other_bus in [('hv', hv_bus, lv_bus), ('lv', lv_bus, hv_bus)]]),
+    ], ignore_index=True)
+
+    if output_path is not None:
+        m_template.to_csv(output_path, index=False)
+        logger.info('Please go to %s and select the measurements you need for your study.', output_path)
+    return m_template
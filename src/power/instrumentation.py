@@ -0,0 +1,110 @@
+import contextlib
+import functools
+import json
+import logging
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError: #not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+def configure_logging(level=logging.INFO, stream=None):
+    #Shows the progress messages of the generator as plain lines on stdout (as the former print statements did).
+    #level=logging.DEBUG adds one line per scenario and per timed stage, logging.WARNING keeps only failures.
+    package_logger = logging.getLogger(__package__)
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    package_logger.handlers = [handler]
+    package_logger.setLevel(level)
+    package_logger.propagate = False
+    return package_logger
+
+
+def max_rss_mb(who='self'):
+    #Memory high-water mark of this process ('self') or of its terminated/waited-for worker processes ('children')
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN).ru_maxrss
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10 #bytes on macOS, kB elsewhere
+
+
+class RunMetrics:
+    #Timers and counters of a run. Stages accumulate calls and wall time, counters accumulate events (scenarios solved and
+    #failed, NR iterations, power flow time, rejected power flow attempts, rows written). With per_scenario, one record
+    #per AC scenario (id, NR iterations, power flow time, attempts, error) is kept as well; switch it off for very long
+    #runs.
+
+    def __init__(self, per_scenario=True):
+        self.reset(per_scenario)
+
+    def reset(self, per_scenario=None):
+        if per_scenario is not None:
+            self.per_scenario = per_scenario
+        self.started = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.scenarios = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stage = self.stages.setdefault(name, {'calls': 0, 'time_s': 0.0})
+            stage['calls'] += 1
+            stage['time_s'] += elapsed
+            stage['max_rss_mb'] = max_rss_mb()
+            logger.debug('%s: %.4f s', name, elapsed)
+
+    def timed(self, name):
+        #Decorator timing every call of a function as stage name
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def scenario(self, scen_id, iterations=None, pf_time=None, error=None, attempts=None):
+        if self.per_scenario:
+            self.scenarios.append({'id': scen_id, 'iterations': iterations, 'pf_time_s': pf_time, 'attempts': attempts,
+                                   'error': error})
+
+    def summary(self):
+        counters = dict(self.counters)
+        if counters.get('ac_scenarios_solved'):
+            counters['nr_iterations_mean'] = counters.get('nr_iterations', 0) / counters['ac_scenarios_solved']
+            counters['pf_time_mean_s'] = counters.get('pf_time_s', 0.0) / counters['ac_scenarios_solved']
+        summary = {'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                   'wall_time_s': time.time() - self.started,
+                   'max_rss_mb': max_rss_mb(),
+                   'max_rss_workers_mb': max_rss_mb('children'),
+                   'stages': self.stages,
+                   'counters': counters}
+        if self.per_scenario:
+            summary['scenarios'] = self.scenarios
+        return summary
+
+    def write(self, path):
+        #Writes the summary as JSON, path is a file or a folder (e.g. the run folder) that gets metrics.json
+        if os.path.isdir(path):
+            path = os.path.join(path, 'metrics.json')
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=1)
+        logger.info('Metrics written to %s', path)
+        return path
+
+
+metrics = RunMetrics() #shared by all functions of gen_scen_fnctns; metrics.reset() starts a new run
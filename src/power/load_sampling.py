@@ -0,0 +1,123 @@
+import logging
+import zlib
+
+import numpy as np
+from scipy.stats import qmc
+
+from .seeds import scen_seed
+
+logger = logging.getLogger(__name__)
+
+LOAD_FACTORS = 'load_factors' #dataset of the load factors written by write_datasets
+KINDS = ('uniform', 'gaussian', 'correlated', 'lhs', 'sobol')
+JOINT_KINDS = ('lhs', 'sobol') #designs drawn for all scenarios of a run together
+
+
+class LoadSampler:
+    #Load factors (multiplying p_mw and q_mvar of every load) of the scenarios of a run, as one (scenarios x loads)
+    #matrix. Scenario 0 is the base scenario (all factors 1).
+    #kind='uniform': independent factors in [low, high) (the former np.random.uniform(0.1, 1.1, n_loads))
+    #kind='gaussian': independent factors of mean and std
+    #kind='correlated': gaussian factors with covariance cov (n_loads x n_loads), or std and correlation corr between all
+    #loads if cov is None
+    #kind='lhs' or 'sobol': Latin hypercube or scrambled Sobol design in [low, high)^n_loads, i.e. the load space covered
+    #with fewer scenarios than by independent draws (Sobol is balanced for a power of 2 scenarios, base scenario excluded)
+    #Independent kinds draw scenario i from scen_seed(seed, set_id, i) alone, so any range of scenarios (chunks, workers,
+    #shards, resumed checkpoints) gets the factors of the full run. Joint designs are drawn for all n_l_scenarios from
+    #seed and set_id, and every range is cut from that design. Gaussian factors are clipped to clip (no negative loads).
+
+    def __init__(self, kind='uniform', low=0.1, high=1.1, mean=0.6, std=0.3, corr=0.0, cov=None, clip=(0.0, None)):
+        if kind not in KINDS:
+            raise ValueError('Load sampling shall be one of {}, got {!r}'.format(', '.join(KINDS), kind))
+        self.kind = kind
+        self.low = low
+        self.high = high
+        self.mean = mean
+        self.std = std
+        self.corr = corr
+        self.cov = None if cov is None else np.asarray(cov, dtype=float)
+        self.clip = tuple(clip)
+        self._design = (None, None) #(key, design) of the last joint design
+
+    @classmethod
+    def from_params(cls, params):
+        #LoadSampler from params() (e.g. read back from run.json), a kind name, an existing sampler or None (uniform)
+        if params is None:
+            return cls()
+        if isinstance(params, LoadSampler):
+            return params
+        if isinstance(params, str):
+            return cls(params)
+        return cls(**params)
+
+    def params(self):
+        #JSON-serializable parameters, saved with the run
+        params = {'kind': self.kind, 'low': self.low, 'high': self.high, 'mean': self.mean, 'std': self.std,
+                  'corr': self.corr, 'clip': list(self.clip)}
+        if self.cov is not None:
+            params['cov'] = self.cov.tolist()
+        return params
+
+    def __repr__(self):
+        return 'LoadSampler({})'.format(', '.join('{}={!r}'.format(key, value) for key, value in self.params().items()
+                                                 if key != 'cov'))
+
+    def sample(self, seed, set_id, n_l_scenarios, n_loads, scen_idx):
+        #(len(scen_idx) x n_loads) load factors of the given scenarios of a run of n_l_scenarios
+        scen_idx = np.asarray(scen_idx, dtype=int)
+        factor = np.ones((len(scen_idx), n_loads))
+        rows = np.flatnonzero(scen_idx > 0) #scenario 0 is the base scenario
+        if not len(rows):
+            return factor
+        if self.kind in JOINT_KINDS:
+            factor[rows] = self.design(seed, set_id, n_l_scenarios, n_loads)[scen_idx[rows] - 1]
+            return factor
+
+        factor[rows] = self._independent([scen_seed(seed, set_id, i) for i in scen_idx[rows]], n_loads)
+        return factor
+
+    def resample(self, seed, set_id, scen_idx, attempt, n_loads):
+        #New load factors of scenario scen_idx after its factors were rejected (e.g. power flow not converged) attempt
+        #times, seeded from seed, set_id, scen_idx and attempt alone. A point of a joint design is replaced by independent
+        #uniform factors in [low, high).
+        seed_seq = np.random.SeedSequence([seed, zlib.crc32(set_id.encode()), scen_idx, attempt])
+        kind = 'uniform' if self.kind in JOINT_KINDS else self.kind
+        return self._independent([seed_seq], n_loads, kind)[0]
+
+    def _independent(self, seed_seqs, n_loads, kind=None):
+        #One row of factors per seed of the independent kinds
+        kind = kind or self.kind
+        draw = np.random.Generator.random if kind == 'uniform' else np.random.Generator.standard_normal
+        unit = np.array([draw(np.random.default_rng(seed_seq), n_loads) for seed_seq in seed_seqs])
+        if kind == 'uniform':
+            return self.low + (self.high - self.low)*unit #same values as rng.uniform(low, high, n_loads)
+        elif kind == 'gaussian':
+            return np.clip(self.mean + self.std*unit, *self.clip)
+        cov_root = self._cov_root(n_loads) #row by row, a matrix product would round differently for other chunk sizes
+        return np.clip(self.mean + np.array([cov_root @ z for z in unit]), *self.clip)
+
+    def design(self, seed, set_id, n_l_scenarios, n_loads):
+        #Joint design of scenarios 1..n_l_scenarios-1, drawn once and kept for the chunks of the same run
+        key = (seed, set_id, n_l_scenarios, n_loads)
+        if self._design[0] != key:
+            rng = np.random.default_rng(np.random.SeedSequence([seed, zlib.crc32(set_id.encode())]))
+            if self.kind == 'lhs':
+                engine = qmc.LatinHypercube(d=n_loads, seed=rng)
+            else:
+                engine = qmc.Sobol(d=n_loads, scramble=True, seed=rng)
+            unit = engine.random(n_l_scenarios - 1)
+            self._design = (key, self.low + (self.high - self.low)*unit)
+            logger.debug('LoadSampler: %s design of %d scenarios x %d loads drawn', self.kind, n_l_scenarios - 1, n_loads)
+        return self._design[1]
+
+    def _cov_root(self, n_loads):
+        cov = self.cov
+        if cov is None:
+            cov = self.std**2*((1 - self.corr)*np.eye(n_loads) + self.corr*np.ones((n_loads, n_loads)))
+        if cov.shape != (n_loads, n_loads):
+            raise ValueError('Covariance of shape {} does not match {} loads'.format(cov.shape, n_loads))
+        try:
+            return np.linalg.cholesky(cov)
+        except np.linalg.LinAlgError: #positive semi-definite (e.g. corr=1)
+            eigval, eigvec = np.linalg.eigh(cov)
+            return eigvec*np.sqrt(np.clip(eigval, 0, None))
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+from .dataset_writer import ID_COLUMN
+from .fileio import replacing
+from .seeds import run_seed
+
+STD_DEV_FILE = 'meas_std_dev.csv'
+
+
+def draw_noise(rng, clean_meas, std_dev, size, noise_on_meas='gaussian'):
+    #Noisy measurements around clean_meas (broadcast to size) with the instrument std_dev of gen_meas
+    if noise_on_meas == 'gaussian': #noise imposed on measurements either gaussian or uniform
+        return rng.normal(loc=clean_meas, scale=std_dev, size=size)
+    elif noise_on_meas == 'uniform':
+        return rng.uniform(low=clean_meas - std_dev, high=clean_meas + std_dev, size=size)
+    raise ValueError('Noise imposed on clean scenarios shall be either gaussian or uniform, got {!r}'.format(noise_on_meas))
+
+
+def save_std_dev(names, std_dev, path):
+    #Measurement std_dev (as set by gen_meas) next to the datasets, so noise can be drawn without the net
+    with replacing(path) as tmp:
+        pd.DataFrame({'name': names, 'std_dev': std_dev}).to_csv(tmp, index=False)
+
+
+def load_std_dev(path):
+    return pd.read_csv(path, index_col='name', float_precision='round_trip')['std_dev']
+
+
+class NoisyBatches:
+    #Mini-batches of (noisy measurements, ground truth states) drawn on the fly from clean scenarios held once in memory,
+    #instead of datasets duplicated noise_per_clean times on disk. Every batch gets fresh noise from std_dev, so every
+    #epoch sees different noisy samples.
+    #clean_meas and states are the DataFrames of meas2features and pf_states2features (rows matched by l_scenario_id,
+    #duplicated rows are dropped) or arrays with the same scenario order. std_dev is an array in the column order of
+    #clean_meas or a Series indexed by measurement name (see load_std_dev).
+    #Epoch e (shuffling and noise) depends only on seed and e: iterating twice with the same seed gives the same batches,
+    #and epoch(e) reproduces any single epoch.
+
+    def __init__(self, clean_meas, states, std_dev, batch_size=256, noise_on_meas='gaussian', shuffle=True,
+                 drop_last=False, seed=None):
+        if isinstance(clean_meas, pd.DataFrame):
+            clean_meas = clean_meas.drop_duplicates(ID_COLUMN).set_index(ID_COLUMN)
+            if isinstance(states, pd.DataFrame):
+                states = states.drop_duplicates(ID_COLUMN).set_index(ID_COLUMN).reindex(clean_meas.index)
+                if states.isna().all(axis=1).any():
+                    raise ValueError('No states for scenarios {}'.format(
+                        list(states.index[states.isna().all(axis=1)][:5])))
+            if isinstance(std_dev, pd.Series):
+                std_dev = std_dev.reindex(clean_meas.columns)
+                if std_dev.isna().any():
+                    raise ValueError('No std_dev for measurements {}'.format(list(std_dev.index[std_dev.isna()][:5])))
+            self.ids = clean_meas.index.values
+            self.meas_names = clean_meas.columns.values
+        else:
+            self.ids = None
+            self.meas_names = None
+        self.state_names = states.columns.values if isinstance(states, pd.DataFrame) else None
+        self.clean_meas = np.asarray(clean_meas, dtype=float)
+        self.states = np.asarray(states, dtype=float)
+        self.std_dev = np.asarray(std_dev, dtype=float)
+        if len(self.clean_meas) != len(self.states) or self.std_dev.shape != self.clean_meas.shape[1:]:
+            raise ValueError('{} clean scenarios, {} states and {} std_dev do not match'.format(
+                self.clean_meas.shape, self.states.shape, self.std_dev.shape))
+
+        self.batch_size = batch_size
+        self.noise_on_meas = noise_on_meas
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = run_seed(seed, 'NoisyBatches')
+        self.n_epochs = 0 #epochs started by iterating over the object
+
+    def __len__(self):
+        #batches per epoch
+        n = len(self.clean_meas)
+        return n // self.batch_size if self.drop_last else -(-n // self.batch_size)
+
+    def __iter__(self):
+        epoch = self.n_epochs
+        self.n_epochs += 1
+        return self.epoch(epoch)
+
+    def epoch(self, epoch):
+        rng = np.random.default_rng(np.random.SeedSequence([self.seed, epoch]))
+        n = len(self.clean_meas)
+        order = rng.permutation(n) if self.shuffle else np.arange(n)
+        for start in range(0, len(self) * self.batch_size, self.batch_size):
+            rows = order[start:start + self.batch_size]
+            clean = self.clean_meas[rows]
+            yield draw_noise(rng, clean, self.std_dev, clean.shape, self.noise_on_meas), self.states[rows]
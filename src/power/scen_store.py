@@ -0,0 +1,164 @@
+import copy
+
+import numpy as np
+
+from .fileio import replacing
+
+#Result columns kept per scenario. These are the only quantities read by the feature exporters and by update_meas
+RES_COLUMNS = {
+    'res_bus': ['vm_pu', 'va_degree', 'p_mw', 'q_mvar'],
+    'res_line': ['p_from_mw', 'q_from_mvar', 'p_to_mw', 'q_to_mvar'],
+    'res_trafo': ['p_hv_mw', 'q_hv_mvar', 'p_lv_mw', 'q_lv_mvar'],
+}
+
+
+def net_res(net, meas_map=None):
+    #Result arrays of a solved net keyed by (table, column); only the columns used by meas_map if given
+    if meas_map is None:
+        keys = [(table, column) for table, columns in RES_COLUMNS.items() for column in columns]
+    else:
+        keys = {(table, column) for table, column, _, _ in meas_map}
+    return {(table, column): net[table][column].values for table, column in keys}
+
+
+def gather_meas(meas_map, res, out):
+    #Fills measurement values from result arrays with one gather per result column. res arrays may be 1d (one net) or
+    #2d (one row per scenario); out has the measurements on its last axis.
+    for table, column, meas_pos, element_pos in meas_map:
+        out[..., meas_pos] = res[(table, column)][..., element_pos]
+    return out
+
+
+def net2result(net, factor, meas_map):
+    #Compact copy of what a solved scenario contributes to the store (cheap to send back from a worker process).
+    #Measurement values are gathered from the results with meas_map (see compile_meas_map), net.measurement is not touched.
+    res = {key: values.copy() for key, values in net_res(net).items()}
+    meas_value = gather_meas(meas_map, res, net.measurement['value'].values.copy())
+    return {'load_factor': np.asarray(factor, dtype=float),
+            'res': res,
+            'meas_value': meas_value}
+
+
+class ScenarioStore:
+    #Array-backed replacement of a list of solved pandapower nets. Row r of every array belongs to scenario ids[r].
+
+    def __init__(self, base_net, n_scenarios):
+        self.bus_index = base_net.bus.index.values
+        self.meas_names = base_net.measurement['name'].values.copy()
+        self.meas_std_dev = base_net.measurement['std_dev'].values.copy()
+
+        self.ids = np.empty(n_scenarios, dtype=object)
+        self.filled = np.zeros(n_scenarios, dtype=bool)
+        self.load_factor = np.full((n_scenarios, len(base_net.load)), np.nan)
+        self.res = {}
+        for table, columns in RES_COLUMNS.items():
+            for column in columns:
+                self.res[(table, column)] = np.full((n_scenarios, len(base_net[table])), np.nan)
+        self.meas_value = np.full((n_scenarios, len(self.meas_names)), np.nan)
+        self.iterations = np.full(n_scenarios, -1) #NR iterations (-1 if not solved by AC power flow)
+        self.pf_time = np.full(n_scenarios, np.nan) #power flow wall time [s]
+        self.attempts = np.zeros(n_scenarios, dtype=int) #power flows tried until convergence (see RetryPolicy), 0 if not AC
+        self.outage = np.full(n_scenarios, '', dtype=object) #branch out of service in contingency scenarios, e.g. 'line3'
+        self.failed = [] #(id, error) of scenarios that did not converge
+
+    def __len__(self):
+        return len(self.ids)
+
+    def put(self, row, scen_id, result):
+        self.ids[row] = scen_id
+        self.load_factor[row] = result['load_factor']
+        for key, values in result['res'].items():
+            self.res[key][row] = values
+        self.meas_value[row] = result['meas_value']
+        self.iterations[row] = result.get('iterations', -1)
+        self.pf_time[row] = result.get('pf_time', np.nan)
+        self.attempts[row] = result.get('attempts', 0)
+        self.outage[row] = result.get('outage', '')
+        self.filled[row] = True
+
+    def put_batch(self, rows, scen_ids, load_factor, res, meas_value, outage=''):
+        #Fills several rows at once, res arrays have one row per scenario
+        self.ids[rows] = scen_ids
+        self.outage[rows] = outage
+        self.load_factor[rows] = load_factor
+        for key, values in res.items():
+            self.res[key][rows] = values
+        self.meas_value[rows] = meas_value
+        self.filled[rows] = True
+
+    def take(self, rows):
+        #New store holding the given rows (in the given order, repetitions allowed)
+        rows = np.asarray(rows, dtype=int)
+        new = copy.copy(self)
+        new.ids = self.ids[rows]
+        new.filled = self.filled[rows]
+        new.load_factor = self.load_factor[rows]
+        new.res = {key: values[rows] for key, values in self.res.items()}
+        new.meas_value = self.meas_value[rows]
+        new.iterations = self.iterations[rows]
+        new.pf_time = self.pf_time[rows]
+        new.attempts = self.attempts[rows]
+        new.outage = self.outage[rows]
+        new.failed = list(self.failed)
+        return new
+
+    def compact(self):
+        #Drop rows that were never filled (e.g. failed scenarios)
+        return self.take(np.flatnonzero(self.filled))
+
+    @property
+    def vm_pu(self):
+        return self.res[('res_bus', 'vm_pu')]
+
+    @property
+    def va_degree(self):
+        return self.res[('res_bus', 'va_degree')]
+
+    @property
+    def nbytes(self):
+        return (self.load_factor.nbytes + self.meas_value.nbytes +
+                sum(values.nbytes for values in self.res.values()))
+
+
+def concat_stores(stores):
+    #Single store holding the rows of all given stores (of the same base net) in order
+    if len(stores) == 1:
+        return stores[0]
+    new = copy.copy(stores[0])
+    for name in ['ids', 'filled', 'load_factor', 'meas_value', 'iterations', 'pf_time', 'attempts', 'outage']:
+        setattr(new, name, np.concatenate([getattr(store, name) for store in stores]))
+    new.res = {key: np.concatenate([store.res[key] for store in stores]) for key in stores[0].res}
+    new.failed = [failure for store in stores for failure in store.failed]
+    return new
+
+
+def save_store(store, path):
+    #Saves a store to one npz file (loadable without the base net)
+    arrays = {'ids': store.ids.astype('U'), 'filled': store.filled, 'load_factor': store.load_factor,
+              'meas_value': store.meas_value, 'iterations': store.iterations, 'pf_time': store.pf_time,
+              'attempts': store.attempts,
+              'outage': store.outage.astype('U'),
+              'bus_index': store.bus_index, 'meas_names': store.meas_names.astype('U'), 'meas_std_dev': store.meas_std_dev,
+              'failed_ids': np.array([scen_id for scen_id, _ in store.failed], dtype='U'),
+              'failed_errors': np.array([err for _, err in store.failed], dtype='U')}
+    for (table, column), values in store.res.items():
+        arrays['res:{}:{}'.format(table, column)] = values
+    with replacing(path) as tmp, open(tmp, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+def load_store(path):
+    with np.load(path) as arrays:
+        store = ScenarioStore.__new__(ScenarioStore)
+        store.ids = arrays['ids'].astype(object)
+        store.meas_names = arrays['meas_names'].astype(object)
+        store.outage = arrays['outage'].astype(object)
+        for name in ['filled', 'load_factor', 'meas_value', 'iterations', 'pf_time', 'attempts', 'bus_index', 'meas_std_dev']:
+            setattr(store, name, arrays[name])
+        store.res = {}
+        for key in arrays.files:
+            if key.startswith('res:'):
+                _, table, column = key.split(':')
+                store.res[(table, column)] = arrays[key]
+        store.failed = list(zip(arrays['failed_ids'].tolist(), arrays['failed_errors'].tolist()))
+    return store
@@ -0,0 +1,20 @@
+import logging
+import zlib
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def run_seed(seed, caller):
+    #Seed of a run: seed as int, or fresh entropy (logged so the run can be repeated) if None
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+        logger.info('%s: No seed given, using seed %s', caller, seed)
+    return int(seed)
+
+
+def scen_seed(seed, set_id, scen_idx):
+    #Seed of a single load scenario. It only depends on the run seed, the set_id and the scenario index so that
+    #scenario i is identical whichever worker (or how many workers) computes it
+    return np.random.SeedSequence([seed, zlib.crc32(set_id.encode()), scen_idx])
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from .fileio import replacing
+
+
+class SparseH:
+    #DC measurement matrix held as a scipy.sparse CSR matrix. Rows are labelled as in h4all (e.g. pfl3_1_3, p5) and
+    #columns are the bus indices.
+
+    def __init__(self, matrix, labels, columns):
+        self.matrix = sp.csr_matrix(matrix)
+        self.labels = pd.Index(labels, name='label')
+        self.columns = pd.Index(columns)
+        if self.matrix.shape != (len(self.labels), len(self.columns)):
+            raise ValueError('H of shape {} does not match {} labels x {} columns'.format(
+                self.matrix.shape, len(self.labels), len(self.columns)))
+
+    @classmethod
+    def from_frame(cls, frame):
+        return cls(frame.values, frame.index, frame.columns)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def positions(self, labels):
+        positions = self.labels.get_indexer(labels)
+        if (positions < 0).any():
+            raise KeyError('Labels not in H: {}'.format(list(np.asarray(labels)[positions < 0])))
+        return positions
+
+    def rows(self, labels):
+        #Sparse rows of H in the order of the given labels
+        return self.matrix[self.positions(labels)]
+
+    def to_frame(self):
+        #Dense view, same layout as the DataFrame returned by gen_h4all(net, dense=True)
+        return pd.DataFrame(self.matrix.toarray(), index=self.labels, columns=self.columns)
+
+
+def save_h(h, path):
+    #Saves a SparseH (or a dense H DataFrame) to one compressed npz file: the CSR arrays, the row labels and the columns
+    if isinstance(h, pd.DataFrame):
+        h = SparseH.from_frame(h)
+    with replacing(path) as tmp, open(tmp, 'wb') as f:
+        np.savez_compressed(f, data=h.matrix.data, indices=h.matrix.indices, indptr=h.matrix.indptr,
+                            shape=np.array(h.shape), labels=np.asarray(h.labels, dtype='U'), columns=np.asarray(h.columns))
+
+
+def load_h(path, dense=False):
+    #Loads an H saved by save_h as SparseH (.matrix is the scipy.sparse CSR matrix), or with dense=True as the DataFrame
+    #read from the former csv files (index = labels, columns = bus indices)
+    with np.load(path) as arrays:
+        matrix = sp.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=tuple(arrays['shape']))
+        h = SparseH(matrix, arrays['labels'].astype(object), arrays['columns'])
+    return h.to_frame() if dense else h
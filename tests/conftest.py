@@ -0,0 +1,25 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) #src.power imported as in the notebooks
+
+import pandapower.networks as nw
+import pytest
+
+from src.power.gen_scen_fnctns import gen_meas_picker, prepare_base_net
+
+INST_ERR = 0.02
+
+
+@pytest.fixture
+def template():
+    #default measurement template of case14 with the bus measurements picked as well (all but currents)
+    all_meas = gen_meas_picker(nw.case14(), output_path=None)
+    all_meas['meas_picked'] = all_meas['meas_type'] != 'i'
+    return all_meas
+
+
+@pytest.fixture
+def base_net(tmp_path, template):
+    net, *_ = prepare_base_net(nw.case14(), template, str(tmp_path) + '/', INST_ERR)
+    return net
@@ -0,0 +1,10 @@
+from src.power.base_cache import ArtifactCache
+
+
+def test_store_keeps_published_entry(tmp_path):
+    #a job that missed the cache must not replace the entry another job published (and may be reading) meanwhile
+    cache = ArtifactCache(str(tmp_path))
+    cache.store('key', {'h': 1})
+    cache.store('key', {'h': 2})
+    assert cache.load('key') == {'h': 1}
+    assert [key for _, _, key in cache.entries()] == ['key']
@@ -0,0 +1,125 @@
+#Template, measurements and H of case14 against the per-row construction they replaced, and the base net cache
+import filecmp
+import os
+
+import numpy as np
+import pandapower as pp
+import pandapower.networks as nw
+import pandas as pd
+
+from src.power import base_cache
+from src.power.base_cache import hash_base_inputs
+from src.power.gen_scen_fnctns import H_FILES, gen_h4all, gen_meas, gen_meas_picker, prepare_base_net
+from src.power.noisy_batches import STD_DEV_FILE
+from conftest import INST_ERR
+
+
+def reference_template(net):
+    rows = [[False, meas_type, 'bus', bus, bus, bus, bus] for bus in net.bus.index for meas_type in ['v', 'p', 'q']]
+    for element_type, sides in [('line', [('from', 'from_bus', 'to_bus'), ('to', 'to_bus', 'from_bus')]),
+                                ('trafo', [('hv', 'hv_bus', 'lv_bus'), ('lv', 'lv_bus', 'hv_bus')])]:
+        table = net[element_type]
+        for element in table.index:
+            rows += [[meas_type != 'i', meas_type, element_type, element, side, table.at[element, bus], table.at[element, other]]
+                     for meas_type in ['p', 'q', 'i'] for side, bus, other in sides]
+    return pd.DataFrame(rows, columns=['meas_picked', 'meas_type', 'element_type', 'element', 'side', 'side_idx',
+                                       'other_side_idx'])
+
+
+def reference_h4all(net):
+    #one row per branch direction and bus injection, impedance base vn_kv**2/sn_mva of the from bus
+    rows, labels = [], []
+    for element_type, prefix, from_column, to_column in [('line', 'pfl', 'from_bus', 'to_bus'), ('trafo', 'pft', 'lv_bus', 'hv_bus')]:
+        for element, branch in net[element_type].iterrows():
+            if element_type == 'line':
+                imp_base = net.bus.at[branch['from_bus'], 'vn_kv']**2/net.sn_mva
+                b = 1/(branch['length_km']*branch['x_ohm_per_km']/branch['parallel']/imp_base)
+            else:
+                z_pu = branch['vk_percent']/100*net.sn_mva/branch['sn_mva']
+                r_pu = branch['vkr_percent']/100*net.sn_mva/branch['sn_mva']
+                b = 1/np.sqrt(z_pu**2 - r_pu**2)
+            f, t = int(branch[from_column]), int(branch[to_column])
+            row = np.zeros(len(net.bus))
+            row[f], row[t] = b, -b
+            rows += [row, -row]
+            labels += ['{}{}_{}_{}'.format(prefix, element, f, t), '{}{}_{}_{}'.format(prefix, element, t, f)]
+    origin = [int(label.split('_')[1]) for label in labels]
+    for bus in net.bus.index:
+        rows.append(-sum(row for row, f in zip(rows[:len(origin)], origin) if f == bus))
+        labels.append('p' + str(bus))
+    return pd.DataFrame(rows, index=pd.Index(labels, name='label'), columns=pd.RangeIndex(len(net.bus)))
+
+
+def reference_meas(net, all_meas, h4all):
+    #pp.create_measurement per picked row, H row from h4all for active power and zero otherwise
+    columns = {('bus', None): 'res_bus', ('line', 'from'): 'from', ('line', 'to'): 'to', ('trafo', 'lv'): 'lv', ('trafo', 'hv'): 'hv'}
+    picked = all_meas.loc[all_meas['meas_picked']]
+    h = []
+    for element_type, meas_type, prefix in [('bus', 'v', 'v'), ('bus', 'p', 'p'), ('bus', 'q', 'q'), ('line', 'p', 'pfl'),
+                                            ('line', 'q', 'qfl'), ('trafo', 'p', 'pft'), ('trafo', 'q', 'qft')]:
+        group = picked.loc[(picked['element_type'] == element_type) & (picked['meas_type'] == meas_type)]
+        for _, row in group.iterrows():
+            element = row['element']
+            if element_type == 'bus':
+                name, side = prefix + str(element), None
+                value = net.res_bus.at[element, {'v': 'vm_pu', 'p': 'p_mw', 'q': 'q_mvar'}[meas_type]]
+            else:
+                name, side = '{}{}_{}_{}'.format(prefix, element, row['side_idx'], row['other_side_idx']), row['side']
+                unit = 'mw' if meas_type == 'p' else 'mvar'
+                value = net['res_' + element_type].at[element, '{}_{}_{}'.format(meas_type, columns[(element_type, side)], unit)]
+            err = 0.5*INST_ERR if meas_type == 'v' else INST_ERR
+            pp.create_measurement(net, meas_type, element_type, value, abs(err*value), element, side, name=name)
+            h.append(h4all.loc[name].values if meas_type == 'p' else np.zeros(len(net.bus)))
+    return pd.DataFrame(h, index=net.measurement['name'].values, columns=pd.RangeIndex(len(net.bus)))
+
+
+def test_template_matches_per_row_template(tmp_path):
+    net = nw.case14()
+    gen_meas_picker(net, str(tmp_path / 'template.csv'))
+    reference_template(net).to_csv(tmp_path / 'reference.csv', index=False)
+    assert filecmp.cmp(tmp_path / 'template.csv', tmp_path / 'reference.csv', shallow=False)
+
+
+def test_h4all_matches_per_branch_h4all():
+    net = nw.case14()
+    pd.testing.assert_frame_equal(gen_h4all(net, dense=True), reference_h4all(net), check_exact=False, rtol=1e-12)
+
+
+def test_gen_meas_matches_per_row_measurements(tmp_path, template):
+    net, reference_net = nw.case14(), nw.case14()
+    for grid in (net, reference_net):
+        pp.runpp(grid)
+    h4all = gen_h4all(net)
+    h, h_reordered, h_no_slack = gen_meas(net, template, h4all, str(tmp_path) + '/', INST_ERR, h_formats=('csv',))
+    reference_h = reference_meas(reference_net, template, reference_h4all(reference_net))
+
+    pd.testing.assert_frame_equal(net.measurement, reference_net.measurement, check_exact=False, rtol=1e-12)
+    pd.testing.assert_frame_equal(h, reference_h, check_exact=False, rtol=1e-12)
+    pd.testing.assert_frame_equal(h_no_slack, reference_h.drop(columns=net.ext_grid.bus.values), check_exact=False, rtol=1e-12)
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / 'h.csv', index_col=0), h.rename(columns=str), check_exact=False,
+                                  rtol=1e-12)
+
+
+def test_cache_key_changes_with_version(monkeypatch, template):
+    #cached H of an older version must not be served once CACHE_VERSION is bumped
+    net = nw.case14()
+    key = hash_base_inputs(net, template, INST_ERR)
+    monkeypatch.setattr(base_cache, 'CACHE_VERSION', base_cache.CACHE_VERSION + 1)
+    assert hash_base_inputs(net, template, INST_ERR) != key
+
+
+def test_cache_hit_matches_miss(tmp_path, template):
+    #output paths with a file name prefix, the hit also writes an h format the entry does not hold
+    cache_path = str(tmp_path / 'cache')
+    miss_path, hit_path = str(tmp_path / 'miss_'), str(tmp_path / 'hit_')
+    miss = prepare_base_net(nw.case14(), template, miss_path, INST_ERR, cache_path=cache_path, h_formats=('npz',))
+    hit = prepare_base_net(nw.case14(), template, hit_path, INST_ERR, cache_path=cache_path, h_formats=('npz', 'csv'))
+
+    pd.testing.assert_frame_equal(hit[0].measurement, miss[0].measurement)
+    for miss_h, hit_h in zip(miss[2:], hit[2:]):
+        pd.testing.assert_frame_equal(hit_h, miss_h)
+    for name in [name + '.npz' for name in H_FILES] + [STD_DEV_FILE]:
+        assert filecmp.cmp(miss_path + name, hit_path + name, shallow=False), name
+    for name, miss_h in zip(H_FILES, miss[2:]):
+        pd.testing.assert_frame_equal(pd.read_csv(hit_path + name + '.csv', index_col=0), miss_h.rename(columns=str))
+    assert len(os.listdir(cache_path)) == 1
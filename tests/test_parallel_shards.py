@@ -0,0 +1,54 @@
+#Shards of one run started as parallel command line jobs on a fresh runs folder and cache, as on a cluster: they all
+#prepare the same base_net/ folder and cache entry at once.
+import glob
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from src.power.cli import DEFAULT_CONFIG
+from src.power.dataset_writer import read_dataset
+from src.power.gen_scen_fnctns import DATASET_NAMES
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+N_SHARDS = 6
+SEEDS = ['--seed', '1', '--noise-seed', '2']
+
+
+def cli(*args):
+    return subprocess.Popen([sys.executable, '-m', 'src.power.cli', '--log-level', 'WARNING'] + list(args), cwd=ROOT,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+
+def finish(job):
+    output = job.communicate()[0]
+    assert job.returncode == 0, output[-3000:]
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    runs_path = str(tmp_path) + '/'
+    config = dict(DEFAULT_CONFIG, grid='case14', runs_path=runs_path, meas_template=runs_path + 'meas_template.csv',
+                  n_clean_scenarios=12, noise_per_clean=2, formats=['npz'], h_formats=['npz', 'csv'])
+    with open(runs_path + 'config.json', 'w') as f:
+        json.dump(config, f)
+    finish(cli('template', '--grid', 'case14', '--output', config['meas_template']))
+    return runs_path + 'config.json'
+
+
+def test_parallel_shard_jobs(tmp_path, config_path):
+    jobs = [cli('generate', '--config', config_path, '--trial', 'sharded', '--shard', '{}/{}'.format(k, N_SHARDS), *SEEDS)
+            for k in range(N_SHARDS)]
+    for job in jobs:
+        finish(job)
+    assert glob.glob(os.path.join(str(tmp_path), '**', '*.tmp*'), recursive=True) == []
+
+    datasets = os.path.join(str(tmp_path), 'sharded', 'datasets')
+    finish(cli('merge', os.path.join(datasets, 'merged'), *sorted(glob.glob(os.path.join(datasets, 'shard-*')))))
+    finish(cli('generate', '--config', config_path, '--trial', 'single', *SEEDS))
+    for name in DATASET_NAMES:
+        merged = read_dataset(os.path.join(datasets, 'merged', name), 'npz')
+        single = read_dataset(os.path.join(str(tmp_path), 'single', 'datasets', name), 'npz')
+        assert merged.equals(single), name
@@ -0,0 +1,65 @@
+#Load scenarios of case14: independent of the worker count and of sharding, and DC outages by rank-one updates
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.power.dataset_writer import read_dataset
+from src.power.gen_scen_fnctns import (DATASET_NAMES, DcModel, branch_outages, gen_clean_scen_unfrm, gen_h4all, gen_outage_h,
+                                       meas2features, merge_shards, pf_states2features, write_datasets)
+from src.power.load_sampling import LOAD_FACTORS, LoadSampler
+
+RUN_HP = {'set_id': 'A', 'n_clean_scenarios': 12, 'noise_per_clean': 2, 'noise_on_meas': 'gaussian'}
+
+
+def test_same_scenarios_for_any_worker_count(base_net):
+    runs = [gen_clean_scen_unfrm(base_net, 10, 'A', n_workers=n_workers, seed=3) for n_workers in (1, 2)]
+    (ids, store), (parallel_ids, parallel_store) = runs
+    assert parallel_ids == ids
+    assert parallel_store.failed == store.failed
+    pd.testing.assert_frame_equal(meas2features(parallel_ids, parallel_store), meas2features(ids, store), check_exact=True)
+    pd.testing.assert_frame_equal(pf_states2features(parallel_ids, parallel_store), pf_states2features(ids, store),
+                                  check_exact=True)
+
+
+def test_shards_merge_to_single_run(tmp_path, base_net):
+    kwargs = dict(formats=('npz',), seed=1, noise_seed=2, write_metrics=False)
+    write_datasets(base_net, RUN_HP, str(tmp_path / 'single'), chunk_size=5, **kwargs)
+    shard_paths = [str(tmp_path / 'shard-{}'.format(k)) for k in range(3)]
+    for k, path in enumerate(shard_paths):
+        write_datasets(base_net, RUN_HP, path, shard=(k, 3), **kwargs)
+    merge_shards(shard_paths[::-1], str(tmp_path / 'merged'))
+    for name in DATASET_NAMES + [LOAD_FACTORS]:
+        merged = read_dataset(os.path.join(str(tmp_path / 'merged'), name), 'npz')
+        single = read_dataset(os.path.join(str(tmp_path / 'single'), name), 'npz')
+        pd.testing.assert_frame_equal(merged, single, check_exact=True, obj=name)
+
+
+def test_dc_outages_match_rebuilt_model(base_net):
+    #Sherman-Morrison angles against a dense solve of the outage case (susceptances from gen_outage_h). A nonzero slack
+    #angle, so that outages of the branches at the slack bus also check the update of the slack columns
+    base_net.ext_grid['va_degree'] = 10.
+    h4all = gen_h4all(base_net)
+    model = DcModel(base_net, h4all)
+    factor = LoadSampler.from_params(None).sample(1, 'A', 4, len(base_net.load), np.arange(4))
+    p_inj = model.injections(factor)
+    theta = model.solve(p_inj)
+    ns, slack = model.non_slack, model.slack_pos
+    n_islanding = 0
+    for outage in branch_outages(base_net):
+        outage_h = gen_outage_h(base_net, h4all, *outage)
+        b_bus = -outage_h.rows(['p'+str(bus) for bus in base_net.bus.index]).toarray()
+        theta_out = model.solve_outage(theta, *outage)
+        if np.linalg.matrix_rank(b_bus[np.ix_(ns, ns)]) < len(ns):
+            assert theta_out is None, outage
+            n_islanding += 1
+            continue
+        expected = np.empty_like(theta)
+        expected[slack] = model.slack_va[:, np.newaxis]
+        expected[ns] = np.linalg.solve(b_bus[np.ix_(ns, ns)], p_inj[ns] - b_bus[np.ix_(ns, slack)] @ model.slack_va[:, np.newaxis])
+        np.testing.assert_allclose(theta_out, expected, rtol=1e-9, atol=1e-12, err_msg=str(outage))
+
+        res, _ = model.results(factor, theta_out, outage)
+        flows = (outage_h.matrix @ theta_out).T*base_net.sn_mva
+        np.testing.assert_allclose(res[('res_bus', 'p_mw')], flows[:, model.p_rows], atol=1e-9, err_msg=str(outage))
+    assert n_islanding == 1 #trafo 3 is the only branch of bus 7